@@ -1,5 +1,6 @@
 import graph_plan
 import json
+import logging
 
 
 ACTIONS = [
@@ -199,6 +200,8 @@ def demo3():
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
     demo1()
     demo2()
     demo3()
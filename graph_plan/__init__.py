@@ -1,2 +1,6 @@
 from graph_plan.planner import Planner, Action
+from graph_plan.planner import LayeredPlan, PlanStep
 from graph_plan.planner import state_from_world
+from graph_plan.executor import PlanExecutor
+from graph_plan.session import PlanSession
+from graph_plan.domain import Domain, load_domain
@@ -0,0 +1,93 @@
+import argparse
+import json
+import logging
+import sys
+
+from graph_plan import differential, profiling
+from graph_plan.domain import load_domain
+from graph_plan.service import PlanningService, make_http_server, run_batch
+
+
+log = logging.getLogger('graph_plan')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m graph_plan')
+    parser.add_argument('--log-level', default='WARNING')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='answer plan requests over local HTTP')
+    serve.add_argument('domain', help='JSON or TOML domain description')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--cache-size', type=int, default=4096)
+
+    batch = commands.add_parser('batch', help='answer JSONL plan requests from stdin')
+    batch.add_argument('domain', help='JSON or TOML domain description')
+    batch.add_argument('--workers', type=int, default=8)
+    batch.add_argument('--cache-size', type=int, default=4096)
+
+    profile = commands.add_parser('profile', help='profile planning for one problem of a domain')
+    profile.add_argument('domain', help='JSON or TOML domain description')
+    profile.add_argument('--state', nargs='*', default=[], help='propositions of the initial state')
+    profile.add_argument('--goal', nargs='+', required=True, help='propositions of the goal')
+    profile.add_argument('--top', type=int, default=15, help='hotspots and allocation sites to show per phase')
+    profile.add_argument('--no-allocations', action='store_true', help='skip tracemalloc allocation counts')
+    profile.add_argument('--lazy-mutex', action='store_true')
+
+    check = commands.add_parser('check', help='compare planner engines against the reference on random problems')
+    check.add_argument('--iterations', type=int, default=200)
+    check.add_argument('--seed', type=int, default=None)
+    check.add_argument('--propositions', type=int, default=5)
+    check.add_argument('--actions', type=int, default=6)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+
+    if args.command == 'check':
+        mismatches = differential.run(
+            args.iterations, args.seed, propositions=args.propositions, actions=args.actions,
+        )
+
+        for mismatch in mismatches:
+            print(json.dumps({
+                'engine': mismatch.engine,
+                'reason': mismatch.reason,
+                'problem': mismatch.problem.describe(),
+            }))
+
+        return 1 if mismatches else 0
+
+    if args.command == 'profile':
+        profiler, plan = profiling.profile_domain(
+            args.domain, set(args.state), set(args.goal),
+            allocations=not args.no_allocations, lazy_mutex=args.lazy_mutex,
+        )
+
+        print('plan:', 'not possible' if plan is None else [action.name for action in plan])
+        print(profiler.report(args.top))
+        return
+
+    service = PlanningService(load_domain(args.domain), cache_size=args.cache_size)
+
+    if args.command == 'serve':
+        server = make_http_server(service, args.host, args.port)
+        log.warning('Serving on http://%s:%s', *server.server_address[:2])
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    elif args.command == 'batch':
+        run_batch(service, sys.stdin, sys.stdout, max_workers=args.workers)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Little-endian building blocks shared by the compiled domain and graph
+snapshot formats: length-prefixed arrays, CSR row tables and string tables.
+"""
+import array
+import struct
+import sys
+import typing
+
+
+COUNT = struct.Struct('<I')
+
+
+def csr(rows: typing.Iterable[typing.Iterable[int]]) -> typing.Tuple[array.array, array.array]:
+    offsets = array.array('I', [0])
+    values = array.array('I')
+
+    for row in rows:
+        values.extend(sorted(row))
+        offsets.append(len(values))
+
+    return offsets, values
+
+
+def pack_array(values: array.array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+
+    return COUNT.pack(len(values)) + values.tobytes()
+
+
+def pack_csr(rows: typing.Iterable[typing.Iterable[int]]) -> bytes:
+    offsets, values = csr(rows)
+    return pack_array(offsets) + pack_array(values)
+
+
+def pack_strings(strings: typing.Iterable[str]) -> bytes:
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = array.array('I', [0])
+
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+
+    return pack_array(offsets) + pack_array(array.array('B', b''.join(encoded)))
+
+
+class Reader(object):
+    def __init__(self, data: memoryview, offset: int, error: typing.Type[Exception] = ValueError):
+        self.data = data
+        self.offset = offset
+        self._error = error
+
+    def _next(self, itemsize: int) -> memoryview:
+        if self.offset + COUNT.size > len(self.data):
+            raise self._error('Data is truncated')
+
+        (count,) = COUNT.unpack_from(self.data, self.offset)
+        start = self.offset + COUNT.size
+        end = start + count * itemsize
+
+        if end > len(self.data):
+            raise self._error('Data is truncated')
+
+        self.offset = end
+        return self.data[start:end]
+
+    def array(self, typecode: str) -> array.array:
+        values = array.array(typecode)
+        values.frombytes(self._next(values.itemsize))
+
+        if sys.byteorder != 'little':
+            values.byteswap()
+
+        return values
+
+    def view(self, typecode: str) -> typing.Sequence[int]:
+        """
+        Zero-copy view of the next array. Falls back to a copy on big-endian
+        hosts.
+        """
+        itemsize = array.array(typecode).itemsize
+
+        if sys.byteorder != 'little':
+            values = array.array(typecode)
+            values.frombytes(self._next(itemsize))
+            values.byteswap()
+            return values
+
+        return self._next(itemsize).cast(typecode)
+
+    def csr(self) -> typing.List[typing.List[int]]:
+        offsets = self.array('I').tolist()
+        values = self.array('I').tolist()
+
+        return [
+            values[start:end]
+            for start, end in zip(offsets, offsets[1:])
+        ]
+
+    def strings(self) -> typing.List[str]:
+        offsets = self.array('I')
+        blob = self.array('B').tobytes()
+
+        return [
+            blob[start:end].decode('utf-8')
+            for start, end in zip(offsets, offsets[1:])
+        ]
@@ -0,0 +1,313 @@
+"""
+Differential checks of planner engines against the reference
+GraphBuilder/GraphSolver loop.
+
+Random problems are generated, every engine in ENGINES plans them, and the
+results are compared with the reference: the solvable verdict, the number
+of graph levels the plan needed, and whether the plan actually reaches the
+goal. A mismatch is shrunk to a minimal reproducer.
+"""
+import itertools
+import logging
+import random
+import typing
+
+import attr
+
+from graph_plan import snapshot
+from graph_plan.planner import (
+    Action,
+    GraphBuilder,
+    GraphSolver,
+    Layer,
+    PlanNotFound,
+    PlanNotPossible,
+    Planner,
+    PlanningGraph,
+    PropositionLabel,
+    opposite_proposition,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+@attr.s(frozen=True, slots=True)
+class Problem(object):
+    state = attr.ib(type=typing.FrozenSet[PropositionLabel], converter=frozenset)
+    goal = attr.ib(type=typing.FrozenSet[PropositionLabel], converter=frozenset)
+    actions = attr.ib(type=typing.FrozenSet[Action], converter=frozenset)
+
+    def describe(self):
+        return {
+            'state': sorted(self.state),
+            'goal': sorted(self.goal),
+            'actions': [
+                {
+                    'name': action.name,
+                    'requirements': sorted(action.requirements),
+                    'effects': sorted(action.effects),
+                }
+                for action in sorted(self.actions, key=lambda action: action.name)
+            ],
+        }
+
+
+@attr.s(frozen=True, slots=True)
+class Result(object):
+    # None when the engine says the problem has no plan
+    plan = attr.ib(type=typing.Optional[typing.List[Action]])
+    depth = attr.ib(type=typing.Optional[int], default=None)
+
+
+@attr.s(frozen=True, slots=True)
+class Mismatch(object):
+    engine = attr.ib(type=str)
+    problem = attr.ib(type=Problem)
+    reason = attr.ib(type=str)
+
+
+def random_problem(
+        rng: random.Random,
+        propositions: int = 5,
+        actions: int = 6,
+        max_requirements: int = 2,
+        max_effects: int = 2,
+) -> Problem:
+    labels = [f'p{index}' for index in range(propositions)]
+
+    def literal_sample(count):
+        chosen = rng.sample(labels, count)
+        return {
+            label if rng.random() < 0.7 else opposite_proposition(label)
+            for label in chosen
+        }
+
+    return Problem(
+        state=literal_sample(rng.randint(0, propositions // 2)),
+        goal=literal_sample(rng.randint(1, min(3, propositions))),
+        actions={
+            Action(
+                name=f'a{index}',
+                requirements=literal_sample(rng.randint(0, max_requirements)),
+                effects=literal_sample(rng.randint(1, max_effects)),
+            )
+            for index in range(actions)
+        },
+    )
+
+
+def validate_plan(problem: Problem, plan: typing.List[Action]) -> bool:
+    state = problem.state
+
+    for action in plan:
+        if not action.requirements.issubset(state):
+            return False
+
+        state = action.apply(state)
+
+    return problem.goal.issubset(state)
+
+
+def reference_engine(problem: Problem) -> Result:
+    """
+    The original planning loop: full Layer snapshots in a list, searched
+    with GraphSolver.search_for_solution.
+    """
+    builder = GraphBuilder()
+    solver = GraphSolver()
+
+    layers = [Layer(actions=[], propositions=problem.state)]
+
+    while True:
+        layers.append(builder.calculate_next_layer(layers[-1], problem.actions))
+
+        try:
+            plan = solver.search_for_solution(layers, set(problem.goal))
+
+        except PlanNotFound:
+            continue
+
+        except PlanNotPossible:
+            return Result(plan=None)
+
+        return Result(
+            plan=[action for action in plan if not action.is_noop],
+            depth=len(layers) - 1,
+        )
+
+
+def _plan(planner: Planner, problem: Problem, graph: PlanningGraph) -> Result:
+    try:
+        # the solver returns one step per level, so its length is the depth
+        # the plan was found at, also on graphs that were expanded further
+        solution = planner._search(set(problem.state), set(problem.goal), problem.actions, graph)
+
+    except PlanNotPossible:
+        return Result(plan=None)
+
+    return Result(
+        plan=[action for step in solution for action in step if not action.is_noop],
+        depth=len(solution),
+    )
+
+
+def _planner_engine(planner_factory: typing.Callable[[], Planner]) -> typing.Callable[[Problem], Result]:
+    def engine(problem: Problem) -> Result:
+        return _plan(planner_factory(), problem, PlanningGraph(problem.state))
+
+    return engine
+
+
+# not produced by any action, planning for it expands a graph until it
+# levels off
+_UNREACHABLE = '\0unreachable'
+
+
+def _levelled_graph(problem: Problem) -> PlanningGraph:
+    graph = PlanningGraph(problem.state)
+
+    try:
+        Planner().plan(set(problem.state), {_UNREACHABLE}, problem.actions, graph=graph)
+
+    except PlanNotPossible:
+        pass
+
+    return graph
+
+
+def snapshot_engine(problem: Problem) -> Result:
+    """
+    Plan on a graph that went through a snapshot round trip halfway through
+    its expansion.
+    """
+    graph = PlanningGraph(problem.state)
+    builder = GraphBuilder()
+    graph.add_layer(builder.calculate_next_layer(graph.layer(0), problem.actions))
+
+    return _plan(Planner(), problem, snapshot.load_graph(snapshot.dump_graph(graph)))
+
+
+def warm_graph_engine(problem: Problem) -> Result:
+    """
+    Plan on a graph that was already expanded until it levelled off, for
+    another goal.
+    """
+    return _plan(Planner(), problem, _levelled_graph(problem))
+
+
+def levelled_snapshot_engine(problem: Problem) -> Result:
+    return _plan(Planner(), problem, snapshot.load_graph(snapshot.dump_graph(_levelled_graph(problem))))
+
+
+def iter_plans_engine(problem: Problem) -> Result:
+    def first_plan(max_levels=None):
+        plans = Planner().iter_plans(set(problem.state), set(problem.goal), problem.actions, max_levels)
+        return next(plans, None)
+
+    plan = first_plan()
+    if plan is None:
+        return Result(plan=None)
+
+    # plans come shallowest first, so the first plan's depth is the fewest
+    # levels that yield any plan
+    depth = next(levels for levels in itertools.count(1) if first_plan(levels) is not None)
+
+    return Result(plan=plan, depth=depth)
+
+
+ENGINES: typing.Dict[str, typing.Callable[[Problem], Result]] = {
+    'planner': _planner_engine(Planner),
+    'lazy_mutex': _planner_engine(lambda: Planner(lazy_mutex=True)),
+    'snapshot': snapshot_engine,
+    'warm_graph': warm_graph_engine,
+    'levelled_snapshot': levelled_snapshot_engine,
+    'iter_plans': iter_plans_engine,
+}
+
+
+def compare(
+        problem: Problem,
+        engines: typing.Optional[typing.Mapping[str, typing.Callable[[Problem], Result]]] = None,
+) -> typing.List[Mismatch]:
+    engines = ENGINES if engines is None else engines
+    expected = reference_engine(problem)
+    mismatches = []
+
+    for name, engine in engines.items():
+        try:
+            result = engine(problem)
+
+        except Exception as error:
+            mismatches.append(Mismatch(engine=name, problem=problem, reason=f'raised {error!r}'))
+            continue
+
+        if (result.plan is None) != (expected.plan is None):
+            reason = 'no plan' if result.plan is None else 'plan for an unsolvable problem'
+            mismatches.append(Mismatch(engine=name, problem=problem, reason=reason))
+
+        elif result.plan is not None and not validate_plan(problem, result.plan):
+            mismatches.append(Mismatch(engine=name, problem=problem, reason='invalid plan'))
+
+        elif result.depth is not None and result.depth != expected.depth:
+            mismatches.append(Mismatch(
+                engine=name, problem=problem,
+                reason=f'plan needs {result.depth} levels, reference needs {expected.depth}',
+            ))
+
+    return mismatches
+
+
+def shrink(problem: Problem, is_failing: typing.Callable[[Problem], bool]) -> Problem:
+    """
+    Greedily drop actions, state and goal propositions while `is_failing`
+    still holds.
+    """
+    changed = True
+
+    while changed:
+        changed = False
+
+        candidates = (
+            [attr.evolve(problem, actions=problem.actions - {action}) for action in problem.actions]
+            + [attr.evolve(problem, state=problem.state - {label}) for label in problem.state]
+            + [attr.evolve(problem, goal=problem.goal - {label}) for label in problem.goal if len(problem.goal) > 1]
+        )
+
+        for candidate in candidates:
+            if is_failing(candidate):
+                problem = candidate
+                changed = True
+                break
+
+    return problem
+
+
+def run(
+        iterations: int = 100,
+        seed: typing.Optional[int] = None,
+        engines: typing.Optional[typing.Mapping[str, typing.Callable[[Problem], Result]]] = None,
+        **problem_options,
+) -> typing.List[Mismatch]:
+    """
+    Compare engines on `iterations` random problems and return the shrunk
+    mismatches, at most one per engine.
+    """
+    engines = ENGINES if engines is None else engines
+    rng = random.Random(seed)
+    mismatches = {}
+
+    for _ in range(iterations):
+        problem = random_problem(rng, **problem_options)
+
+        for mismatch in compare(problem, engines):
+            if mismatch.engine in mismatches:
+                continue
+
+            engine = {mismatch.engine: engines[mismatch.engine]}
+            shrunk = shrink(mismatch.problem, lambda candidate: bool(compare(candidate, engine)))
+            mismatches[mismatch.engine] = compare(shrunk, engine)[0]
+
+            log.warning('Engine %s mismatch: %s', mismatch.engine, mismatches[mismatch.engine].reason)
+
+    return list(mismatches.values())
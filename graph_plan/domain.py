@@ -0,0 +1,250 @@
+import hashlib
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import typing
+
+import attr
+
+from graph_plan import _binary
+from graph_plan.planner import Action, PropositionLabel, opposite_proposition
+
+
+log = logging.getLogger(__name__)
+
+
+MAGIC = b'GPDOMAIN'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<8sH32s')
+
+
+class DomainFormatError(ValueError):
+    pass
+
+
+@attr.s(frozen=True, slots=True)
+class Domain(object):
+    """
+    Action catalog with its interned proposition labels.
+    """
+    actions = attr.ib(type=typing.Tuple[Action, ...])
+    labels = attr.ib(type=typing.Tuple[PropositionLabel, ...])
+    fingerprint = attr.ib(type=bytes, default=b'')
+
+    @classmethod
+    def from_actions(cls, actions: typing.Iterable[Action], fingerprint: bytes = b'') -> 'Domain':
+        actions = tuple(actions)
+
+        labels = sorted({
+            proposition
+            for action in actions
+            for proposition in itertools.chain(action.requirements, action.effects, action.deletes)
+        })
+
+        return cls(
+            actions=actions,
+            labels=tuple(labels),
+            fingerprint=fingerprint,
+        )
+
+    @classmethod
+    def from_dict(cls, description: typing.Mapping, fingerprint: bytes = b'') -> 'Domain':
+        """
+        Build a domain from its description:
+
+            {
+                "actions": [
+                    {"name": ..., "requirements": [...], "effects": [...], "deletes": [...]}
+                ],
+                "templates": [
+                    {"name": "reserve_{iface}", ..., "parameters": {"iface": ["ip", "ipmi"]}}
+                ]
+            }
+
+        `deletes` are stored as `__unset` effects. Templates are expanded
+        for every combination of parameter values, substituted into the name
+        and labels with `str.format`.
+        """
+        actions = [
+            cls._action_from_dict(action)
+            for action in description.get('actions', [])
+        ]
+
+        for template in description.get('templates', []):
+            parameters = template.get('parameters', {})
+            names = sorted(parameters)
+
+            for values in itertools.product(*(parameters[name] for name in names)):
+                actions.append(cls._action_from_dict(template, dict(zip(names, values))))
+
+        return cls.from_actions(actions, fingerprint=fingerprint)
+
+    @classmethod
+    def _action_from_dict(cls, description: typing.Mapping, parameters: typing.Mapping = None) -> Action:
+        parameters = parameters or {}
+
+        try:
+            return Action(
+                name=description['name'].format(**parameters),
+                requirements={
+                    label.format(**parameters)
+                    for label in description.get('requirements', [])
+                },
+                effects={
+                    label.format(**parameters)
+                    for label in description.get('effects', [])
+                } | {
+                    opposite_proposition(label.format(**parameters))
+                    for label in description.get('deletes', [])
+                },
+            )
+
+        except (KeyError, IndexError, AttributeError) as error:
+            raise DomainFormatError(f'Invalid action description {description!r}: {error!r}')
+
+    def to_bytes(self) -> bytes:
+        label_bits = {label: bit for bit, label in enumerate(self.labels)}
+
+        sections = [
+            _binary.pack_strings(self.labels),
+            _binary.pack_strings(action.name for action in self.actions),
+            _binary.pack_csr(
+                (label_bits[label] for label in action.requirements)
+                for action in self.actions
+            ),
+            _binary.pack_csr(
+                (label_bits[label] for label in action.effects)
+                for action in self.actions
+            ),
+        ]
+
+        return _HEADER.pack(MAGIC, FORMAT_VERSION, self.fingerprint) + b''.join(sections)
+
+    @classmethod
+    def from_bytes(cls, data: typing.Union[bytes, memoryview, mmap.mmap]) -> 'Domain':
+        with memoryview(data) as view:
+            return cls._from_view(view)
+
+    @classmethod
+    def _from_view(cls, data: memoryview) -> 'Domain':
+        if len(data) < _HEADER.size:
+            raise DomainFormatError('Compiled domain is truncated')
+
+        magic, version, fingerprint = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise DomainFormatError('Not a compiled domain')
+        if version != FORMAT_VERSION:
+            raise DomainFormatError(f'Unsupported compiled domain version {version}')
+
+        reader = _binary.Reader(data, _HEADER.size, error=DomainFormatError)
+
+        labels = tuple(sys.intern(label) for label in reader.strings())
+        names = reader.strings()
+        requirements = reader.csr()
+        effects = reader.csr()
+
+        actions = tuple(
+            Action(
+                name=name,
+                requirements=frozenset([labels[bit] for bit in requirements[index]]),
+                effects=frozenset([labels[bit] for bit in effects[index]]),
+            )
+            for index, name in enumerate(names)
+        )
+
+        return cls(
+            actions=actions,
+            labels=labels,
+            fingerprint=fingerprint if any(fingerprint) else b'',
+        )
+
+
+def _fingerprint(source: bytes) -> bytes:
+    return hashlib.sha256(FORMAT_VERSION.to_bytes(2, 'little') + source).digest()
+
+
+def _parse_source(path: str, source: bytes) -> typing.Mapping:
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+
+        return tomllib.loads(source.decode('utf-8'))
+
+    return json.loads(source)
+
+
+def read_domain(path: str) -> Domain:
+    """
+    Load a JSON or TOML domain description (see `Domain.from_dict`).
+    """
+    with open(path, 'rb') as source_file:
+        source = source_file.read()
+
+    return Domain.from_dict(_parse_source(path, source), fingerprint=_fingerprint(source))
+
+
+def compile_domain(domain: Domain, path: str):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    try:
+        with open(tmp_path, 'wb') as compiled_file:
+            compiled_file.write(domain.to_bytes())
+
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+
+def load_compiled_domain(path: str) -> Domain:
+    with open(path, 'rb') as compiled_file:
+        with mmap.mmap(compiled_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return Domain.from_bytes(data)
+
+
+def load_domain(path: str, cache_path: typing.Optional[str] = None) -> Domain:
+    """
+    Load a domain description, going through the compiled artifact at
+    `cache_path` (default: `<path>.gpd`). The artifact is rebuilt when it is
+    missing, unreadable, or was compiled from a different source. Failing
+    to write it only costs the next load a parse.
+    """
+    cache_path = cache_path or f'{path}.gpd'
+
+    with open(path, 'rb') as source_file:
+        source = source_file.read()
+    fingerprint = _fingerprint(source)
+
+    try:
+        domain = load_compiled_domain(cache_path)
+
+    except (OSError, ValueError, IndexError) as error:
+        log.info('Compiled domain %s is not usable: %r', cache_path, error)
+
+    else:
+        if domain.fingerprint == fingerprint:
+            return domain
+
+        log.info('Compiled domain %s is stale', cache_path)
+
+    domain = Domain.from_dict(_parse_source(path, source), fingerprint=fingerprint)
+
+    try:
+        compile_domain(domain, cache_path)
+
+    except OSError as error:
+        log.warning('Could not write compiled domain %s: %r', cache_path, error)
+
+    return domain
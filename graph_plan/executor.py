@@ -0,0 +1,267 @@
+import asyncio
+import collections
+import concurrent.futures
+import enum
+import inspect
+import logging
+import time
+import typing
+
+import attr
+
+from graph_plan.planner import Action, LayeredPlan, PlanStep, PropositionLabel
+
+
+log = logging.getLogger(__name__)
+
+
+Handler = typing.Callable[[Action], typing.Any]
+
+
+class StepStatus(enum.Enum):
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+
+@attr.s(frozen=True, slots=True)
+class StepResult(object):
+    plan_step = attr.ib(type=PlanStep)
+    status = attr.ib(type=StepStatus)
+    started_at = attr.ib(type=typing.Optional[float], default=None)
+    duration = attr.ib(type=typing.Optional[float], default=None)
+    error = attr.ib(type=typing.Optional[BaseException], default=None)
+
+
+@attr.s(frozen=True, slots=True)
+class ExecutionReport(object):
+    results = attr.ib(type=typing.Dict[PlanStep, StepResult])
+    propositions = attr.ib(type=typing.FrozenSet[PropositionLabel])
+    duration = attr.ib(type=float)
+
+    def _with_status(self, status: StepStatus) -> typing.List[StepResult]:
+        return [
+            result
+            for result in self.results.values()
+            if result.status is status
+        ]
+
+    @property
+    def succeeded(self) -> typing.List[StepResult]:
+        return self._with_status(StepStatus.SUCCEEDED)
+
+    @property
+    def failed(self) -> typing.List[StepResult]:
+        return self._with_status(StepStatus.FAILED)
+
+    @property
+    def skipped(self) -> typing.List[StepResult]:
+        return self._with_status(StepStatus.SKIPPED)
+
+    @property
+    def ok(self) -> bool:
+        return all(result.status is StepStatus.SUCCEEDED for result in self.results.values())
+
+
+class _Schedule(object):
+    """
+    Bookkeeping shared by the thread pool and asyncio executors: which steps
+    are ready to run, which are blocked and which propositions hold so far.
+    """
+
+    def __init__(self, plan: LayeredPlan, state: typing.Iterable[PropositionLabel]):
+        self.propositions = set(state)
+        self.results: typing.Dict[PlanStep, StepResult] = {}
+
+        self._waiting_on = {
+            plan_step: set(plan.dependencies.get(plan_step, ()))
+            for plan_step in plan.plan_steps
+        }
+        self._dependents = collections.defaultdict(set)
+
+        for plan_step, depends_on in self._waiting_on.items():
+            for dependency in depends_on:
+                self._dependents[dependency].add(plan_step)
+
+    def take_ready(self) -> typing.List[PlanStep]:
+        ready = [
+            plan_step
+            for plan_step, depends_on in self._waiting_on.items()
+            if not depends_on
+        ]
+
+        for plan_step in ready:
+            del self._waiting_on[plan_step]
+
+        return ready
+
+    def succeeded(self, plan_step: PlanStep, started_at: float, duration: float):
+        action = plan_step.action
+        self.propositions.difference_update(action.deletes)
+        self.propositions.update(action.effects)
+
+        self.results[plan_step] = StepResult(
+            plan_step=plan_step,
+            status=StepStatus.SUCCEEDED,
+            started_at=started_at,
+            duration=duration,
+        )
+
+        for dependent in self._dependents[plan_step]:
+            if dependent in self._waiting_on:
+                self._waiting_on[dependent].discard(plan_step)
+
+    def failed(self, plan_step: PlanStep, started_at: float, duration: float, error: BaseException):
+        log.info('Step %s failed: %r', plan_step.action.name, error)
+
+        self.results[plan_step] = StepResult(
+            plan_step=plan_step,
+            status=StepStatus.FAILED,
+            started_at=started_at,
+            duration=duration,
+            error=error,
+        )
+
+        blocked = list(self._dependents[plan_step])
+        while blocked:
+            dependent = blocked.pop()
+
+            if dependent not in self._waiting_on:
+                continue
+
+            log.info('Skipping step %s', dependent.action.name)
+            del self._waiting_on[dependent]
+            self.results[dependent] = StepResult(
+                plan_step=dependent,
+                status=StepStatus.SKIPPED,
+            )
+            blocked.extend(self._dependents[dependent])
+
+    def report(self, duration: float) -> ExecutionReport:
+        return ExecutionReport(
+            results=self.results,
+            propositions=frozenset(self.propositions),
+            duration=duration,
+        )
+
+
+class PlanExecutor(object):
+    """
+    Runs a LayeredPlan, starting every step as soon as the steps it depends
+    on have succeeded. `handlers` maps action names to callables that are
+    called with the action; a step fails when its handler raises, and the
+    steps depending on it are skipped.
+    """
+
+    def __init__(self, handlers: typing.Mapping[str, Handler], max_workers: int = 4):
+        self.handlers = handlers
+        self.max_workers = max_workers
+
+    def _check_handlers(self, plan: LayeredPlan):
+        missing = sorted({
+            action.name
+            for action in plan.actions
+            if action.name not in self.handlers
+        })
+
+        if missing:
+            raise ValueError(f'No handlers for actions: {missing}')
+
+    def _run_step(self, plan_step: PlanStep):
+        started_at = time.monotonic()
+
+        try:
+            self.handlers[plan_step.action.name](plan_step.action)
+
+        except Exception as error:
+            return started_at, time.monotonic() - started_at, error
+
+        return started_at, time.monotonic() - started_at, None
+
+    def execute(
+            self,
+            plan: LayeredPlan,
+            state: typing.Iterable[PropositionLabel] = frozenset(),
+    ) -> ExecutionReport:
+        self._check_handlers(plan)
+
+        started_at = time.monotonic()
+        schedule = _Schedule(plan, state)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+
+            while True:
+                for plan_step in schedule.take_ready():
+                    log.info('Starting step %s', plan_step.action.name)
+                    running[pool.submit(self._run_step, plan_step)] = plan_step
+
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    plan_step = running.pop(future)
+                    step_started_at, duration, error = future.result()
+
+                    if error is None:
+                        schedule.succeeded(plan_step, step_started_at, duration)
+                    else:
+                        schedule.failed(plan_step, step_started_at, duration, error)
+
+        return schedule.report(time.monotonic() - started_at)
+
+    async def _run_step_async(self, plan_step: PlanStep, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            started_at = time.monotonic()
+            handler = self.handlers[plan_step.action.name]
+
+            try:
+                if inspect.iscoroutinefunction(handler):
+                    await handler(plan_step.action)
+                else:
+                    await asyncio.get_running_loop().run_in_executor(None, handler, plan_step.action)
+
+            except Exception as error:
+                return started_at, time.monotonic() - started_at, error
+
+            return started_at, time.monotonic() - started_at, None
+
+    async def execute_async(
+            self,
+            plan: LayeredPlan,
+            state: typing.Iterable[PropositionLabel] = frozenset(),
+    ) -> ExecutionReport:
+        """
+        Same as `execute`, but coroutine handlers are awaited on the running
+        event loop. Plain callables are run in the loop's default executor.
+        """
+        self._check_handlers(plan)
+
+        started_at = time.monotonic()
+        schedule = _Schedule(plan, state)
+        semaphore = asyncio.Semaphore(self.max_workers)
+        running = {}
+
+        while True:
+            for plan_step in schedule.take_ready():
+                log.info('Starting step %s', plan_step.action.name)
+                task = asyncio.ensure_future(self._run_step_async(plan_step, semaphore))
+                running[task] = plan_step
+
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                plan_step = running.pop(task)
+                step_started_at, duration, error = task.result()
+
+                if error is None:
+                    schedule.succeeded(plan_step, step_started_at, duration)
+                else:
+                    schedule.failed(plan_step, step_started_at, duration, error)
+
+        return schedule.report(time.monotonic() - started_at)
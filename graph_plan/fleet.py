@@ -0,0 +1,259 @@
+"""
+Helpers for planning over many hosts at once.
+
+States are kept as integer bitmaps over a PropositionIndex, usually the one
+of the domain's DependencyIndex, so that hosts with the same relevant state
+can be grouped and planned for once.
+"""
+import collections
+import collections.abc
+import itertools
+import logging
+import typing
+
+import attr
+
+from graph_plan.planner import (
+    Action,
+    Planner,
+    PlanNotPossible,
+    PropositionIndex,
+    PropositionLabel,
+    UNSET_SUFFIX,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+World = typing.Mapping[str, typing.Any]
+Worlds = typing.Union[typing.Iterable[World], typing.Mapping[str, typing.Sequence[typing.Any]]]
+
+# value of a key that is not present in a world dict
+_MISSING = object()
+
+
+def _columns(worlds: Worlds) -> typing.Tuple[int, typing.Dict[str, typing.Sequence[typing.Any]]]:
+    if isinstance(worlds, collections.abc.Mapping):
+        lengths = {len(column) for column in worlds.values()}
+
+        if len(lengths) > 1:
+            raise ValueError('Columns have different lengths')
+
+        return (lengths.pop() if lengths else 0), dict(worlds)
+
+    worlds = list(worlds)
+    columns = collections.defaultdict(lambda: [_MISSING] * len(worlds))
+
+    for row, world in enumerate(worlds):
+        for key, value in world.items():
+            columns[key][row] = value
+
+    return len(worlds), columns
+
+
+def states_from_worlds(worlds: Worlds, index: PropositionIndex) -> typing.List[int]:
+    """
+    Bulk version of `state_from_world`. `worlds` is either a list of world
+    dicts or a table of columns (`{key: [value per host]}`). Returns one
+    bitmap per host over `index`; propositions that are not in `index` are
+    left out, the same way `Planner.relevant_state` drops them.
+    """
+    count, columns = _columns(worlds)
+    states = [0] * count
+
+    for key, values in columns.items():
+        set_mask = 1 << index.bit(key) if key in index else 0
+        unset_label = f'{key}{UNSET_SUFFIX}'
+        unset_mask = 1 << index.bit(unset_label) if unset_label in index else 0
+
+        if not set_mask and not unset_mask:
+            continue
+
+        for row, value in enumerate(values):
+            if value is not _MISSING:
+                states[row] |= set_mask if value else unset_mask
+
+    return states
+
+
+def states_matrix(worlds: Worlds, index: PropositionIndex):
+    """
+    Same as `states_from_worlds`, as a NumPy boolean matrix with a row per
+    host and a column per proposition of `index`. Requires numpy.
+    """
+    import numpy
+
+    count, columns = _columns(worlds)
+    matrix = numpy.zeros((count, len(index)), dtype=bool)
+
+    for key, values in columns.items():
+        present = numpy.array([value is not _MISSING for value in values], dtype=bool)
+        values = numpy.array([value is not _MISSING and bool(value) for value in values], dtype=bool)
+        unset_label = f'{key}{UNSET_SUFFIX}'
+
+        if key in index:
+            matrix[:, index.bit(key)] = values
+        if unset_label in index:
+            matrix[:, index.bit(unset_label)] = present & ~values
+
+    return matrix
+
+
+def group_states(states: typing.Iterable[int]) -> typing.Dict[int, typing.List[int]]:
+    """
+    Map every distinct state to the positions of the hosts that are in it.
+    """
+    groups = collections.defaultdict(list)
+
+    for position, state in enumerate(states):
+        groups[state].append(position)
+
+    return dict(groups)
+
+
+def plan_worlds(
+        worlds: Worlds,
+        goal: typing.Set[PropositionLabel],
+        actions: typing.Set[Action],
+        planner: typing.Optional[Planner] = None,
+) -> typing.List[typing.Optional[typing.List[Action]]]:
+    """
+    Plan for every host, searching once per distinct relevant state: the
+    propositions the actions depend on and the goal. Hosts for which no
+    plan exists get `None`. Hosts in the same state get equal but separate
+    lists.
+    """
+    planner = planner or Planner()
+    index = planner.dependency_index(actions).propositions
+
+    # the dependency index is shared, goal labels no action touches go into
+    # a copy of it
+    missing = sorted(label for label in goal if label not in index)
+    if missing:
+        index = PropositionIndex(itertools.chain(index.labels, missing))
+
+    groups = group_states(states_from_worlds(worlds, index))
+    log.info('Planning for %s distinct states', len(groups))
+
+    plans = {}
+    for state in groups:
+        try:
+            plans[state] = planner.plan(index.propositions(state), goal, actions)
+
+        except PlanNotPossible:
+            log.info('Plan is not possible for state %s', index.propositions(state))
+            plans[state] = None
+
+    # every host gets its own list, so callers can edit one host's plan
+    results = [None] * sum(len(positions) for positions in groups.values())
+    for state, positions in groups.items():
+        for position in positions:
+            results[position] = None if plans[state] is None else list(plans[state])
+
+    return results
+
+
+# stands in for the subproblem name in canonical labels
+_PLACEHOLDER = '\0'
+
+
+def _frozen(values: typing.Iterable) -> typing.FrozenSet:
+    return frozenset(values)
+
+
+@attr.s(frozen=True, slots=True)
+class Subproblem(object):
+    """
+    Independent planning problem, for example one host. `name` is the part
+    of labels and action names that differs between otherwise identical
+    subproblems, such as the host name in `reimage[host1]`.
+    """
+    name = attr.ib(type=str)
+    state = attr.ib(type=typing.FrozenSet[PropositionLabel], converter=_frozen)
+    goal = attr.ib(type=typing.FrozenSet[PropositionLabel], converter=_frozen)
+    actions = attr.ib(type=typing.FrozenSet[Action], converter=_frozen)
+
+    def _canonical(self, label: str) -> str:
+        return label.replace(self.name, _PLACEHOLDER)
+
+    def _canonical_action(self, action: Action) -> typing.Tuple:
+        return (
+            self._canonical(action.name),
+            frozenset(self._canonical(label) for label in action.requirements),
+            frozenset(self._canonical(label) for label in action.effects),
+        )
+
+    def signature(self) -> typing.Hashable:
+        """
+        Name-independent signature. Subproblems with equal signatures have
+        the same plans up to renaming.
+        """
+        relevant = {
+            label
+            for action in self.actions
+            for label in action.requirements | action.effects
+        } | self.goal
+
+        return (
+            frozenset(self._canonical(label) for label in self.state if label in relevant),
+            frozenset(self._canonical(label) for label in self.goal),
+            frozenset(self._canonical_action(action) for action in self.actions),
+        )
+
+    def rename_plan(self, plan: typing.List[Action], representative: 'Subproblem') -> typing.List[Action]:
+        actions = {
+            self._canonical_action(action): action
+            for action in self.actions
+        }
+
+        return [
+            actions[representative._canonical_action(action)]
+            for action in plan
+        ]
+
+
+def plan_subproblems(
+        subproblems: typing.Iterable[Subproblem],
+        planner: typing.Optional[Planner] = None,
+) -> typing.Dict[str, typing.Optional[typing.List[Action]]]:
+    """
+    Plan for every subproblem, searching once per signature and renaming the
+    representative's plan for the rest. Subproblems without a plan get
+    `None`.
+    """
+    planner = planner or Planner()
+
+    groups = collections.defaultdict(list)
+    for subproblem in subproblems:
+        groups[subproblem.signature()].append(subproblem)
+
+    log.info('Planning for %s distinct subproblems', len(groups))
+
+    plans = {}
+    for group in groups.values():
+        representative = group[0]
+
+        try:
+            # goal labels already in the state are relevant even when no
+            # action touches them
+            state = planner.relevant_state(representative.state, representative.actions)
+            state |= representative.state & representative.goal
+
+            plan = planner.plan(
+                state,
+                set(representative.goal),
+                representative.actions,
+            )
+
+        except PlanNotPossible:
+            log.info('Plan is not possible for %s', representative.name)
+            plan = None
+
+        for subproblem in group:
+            if plan is None or subproblem is representative:
+                plans[subproblem.name] = plan
+            else:
+                plans[subproblem.name] = subproblem.rename_plan(plan, representative)
+
+    return plans
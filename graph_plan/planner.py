@@ -1,43 +1,102 @@
+"""
+Graphplan-style planner.
+
+Concurrency: a Planner can be shared between threads. Every `plan` call
+builds its own PlanningGraph and keeps its search state on the stack, so
+calls do not see each other. The caches shared between calls (canonical
+noop actions, dependency indexes and fingerprints per action set) are only
+written while holding a lock and are read without one; the per action set
+caches keep the `cache_size` most recently added entries. Actions, Layers and Domains are
+immutable. A PlanningGraph or PlanSession belongs to one caller at a time;
+pass a graph to concurrent calls only after loading a separate copy for
+each of them.
+
+The module does not configure logging; applications do that.
+"""
 import collections
+import collections.abc
+import hashlib
 import itertools
 import json
 import logging
-import re
+import sys
+import threading
 import typing
+import weakref
 
 import attr
 
 
 log = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 
 PropositionLabel = str
 
+UNSET_SUFFIX = '__unset'
 
-@attr.s(repr=False)
+
+def opposite_proposition(proposition: PropositionLabel) -> PropositionLabel:
+    if proposition.endswith(UNSET_SUFFIX):
+        return proposition[:-len(UNSET_SUFFIX)]
+
+    return f'{proposition}{UNSET_SUFFIX}'
+
+
+def _frozen_propositions(propositions) -> typing.FrozenSet[PropositionLabel]:
+    if type(propositions) is frozenset:
+        return propositions
+
+    return frozenset(sys.intern(proposition) for proposition in propositions)
+
+
+def _layer_propositions(propositions) -> typing.AbstractSet[PropositionLabel]:
+    # level views of a PlanningGraph are read-only and kept as they are
+    if isinstance(propositions, _LevelPropositions):
+        return propositions
+
+    return _frozen_propositions(propositions)
+
+
+def _frozen_mutex(mutex: typing.Mapping) -> typing.Dict:
+    # identical mutex sets are shared between keys, which is the common case
+    # for propositions produced by the same group of actions
+    canonical = {}
+    frozen = {}
+
+    for key, values in mutex.items():
+        values = frozenset(values)
+        frozen[key] = canonical.setdefault(values, values)
+
+    return frozen
+
+
+@attr.s(repr=False, slots=True, frozen=True)
 class Layer(object):
     actions = attr.ib(type=typing.List['Action'])
-    propositions = attr.ib(type=typing.Set[PropositionLabel])
+    propositions = attr.ib(
+        type=typing.FrozenSet[PropositionLabel],
+        converter=_layer_propositions)
     mutex_actions = attr.ib(
-        type=typing.Dict['Action', typing.Set['Action']],
+        type=typing.Dict['Action', typing.FrozenSet['Action']],
         default=attr.Factory(dict))
     mutex_propositions = attr.ib(
-        type=typing.Dict[PropositionLabel, typing.Set[PropositionLabel]],
+        type=typing.Dict[PropositionLabel, typing.FrozenSet[PropositionLabel]],
         default=attr.Factory(dict))
 
     def copy(self, **changes):
         return attr.evolve(self, **changes)
 
     def describe(self):
+        # lazily computed mutexes describe themselves without computing the
+        # remaining pairs, see PlanningGraph
         return {
             'actions': [action.name for action in self.actions],
             'propositions': list(self.propositions),
-            'mutex_actions': {
+            'mutex_actions': _describe_mutex(self.mutex_actions) or {
                 action.name: [mutex_action.name for mutex_action in mutex_actions]
                 for action, mutex_actions in self.mutex_actions.items()
             },
-            'mutex_propositions': {
+            'mutex_propositions': _describe_mutex(self.mutex_propositions) or {
                 proposition: list(mutex_propositions)
                 for proposition, mutex_propositions in self.mutex_propositions.items()
             }
@@ -47,22 +106,73 @@ class Layer(object):
         return json.dumps(self.describe())
 
 
-@attr.s(frozen=True)
+@attr.s(frozen=True, slots=True, cache_hash=True)
 class Action(object):
-    name = attr.ib(type=str)
-    requirements = attr.ib(type=typing.Set[PropositionLabel], hash=False)
-    effects = attr.ib(type=typing.Set[PropositionLabel], hash=False)
+    name = attr.ib(type=str, converter=sys.intern)
+    requirements = attr.ib(
+        type=typing.FrozenSet[PropositionLabel],
+        converter=_frozen_propositions,
+        hash=False)
+    effects = attr.ib(
+        type=typing.FrozenSet[PropositionLabel],
+        converter=_frozen_propositions,
+        hash=False)
+    deletes = attr.ib(
+        type=typing.FrozenSet[PropositionLabel],
+        init=False, hash=False, eq=False, repr=False)
+
+    def __attrs_post_init__(self):
+        object.__setattr__(self, 'deletes', frozenset([
+            opposite_proposition(effect) for effect in self.effects
+        ]))
+
+    @property
+    def is_noop(self):
+        return self.name.startswith('noop_')
+
+    def apply(self, propositions: typing.AbstractSet[PropositionLabel]) -> typing.FrozenSet[PropositionLabel]:
+        return frozenset(propositions).difference(self.deletes).union(self.effects)
 
     def copy(self, **changes):
         return attr.evolve(self, **changes)
 
     @classmethod
     def noop_action(cls, proposition):
-        return cls(
-            name=f'noop_{proposition}',
-            requirements={proposition},
-            effects={proposition},
-        )
+        try:
+            return _noop_actions[proposition]
+
+        except KeyError:
+            propositions = frozenset({sys.intern(proposition)})
+            action = cls(
+                name=f'noop_{proposition}',
+                requirements=propositions,
+                effects=propositions,
+            )
+
+            with _noop_actions_lock:
+                return _noop_actions.setdefault(proposition, action)
+
+
+# entries go away with the last graph or layer that uses them, so labels
+# seen once (for example in a service request) are not kept forever
+_noop_actions: typing.MutableMapping[PropositionLabel, Action] = weakref.WeakValueDictionary()
+_noop_actions_lock = threading.Lock()
+
+
+def actions_fingerprint(actions: typing.Iterable[Action]) -> bytes:
+    """
+    Digest of an action set that does not depend on iteration order. A
+    PlanningGraph records it so it is only reused with the same actions.
+    """
+    digest = hashlib.sha256()
+
+    for description in sorted(
+            (action.name, sorted(action.requirements), sorted(action.effects))
+            for action in actions
+    ):
+        digest.update(json.dumps(description).encode('utf-8'))
+
+    return digest.digest()
 
 
 class PlanNotFound(BaseException):
@@ -73,7 +183,124 @@ class PlanNotPossible(BaseException):
     pass
 
 
+@attr.s(frozen=True, slots=True)
+class PlanStep(object):
+    step = attr.ib(type=int)
+    action = attr.ib(type=Action)
+
+
+def _actions_interfere(action_a: Action, action_b: Action) -> bool:
+    return not (
+        action_a.deletes.isdisjoint(action_b.requirements)
+        and action_a.deletes.isdisjoint(action_b.effects)
+        and action_b.deletes.isdisjoint(action_a.requirements)
+        and action_b.deletes.isdisjoint(action_a.effects)
+    )
+
+
+@attr.s(frozen=True, slots=True)
+class LayeredPlan(object):
+    """
+    Plan as a list of steps. Actions within a step are not mutex and can run
+    concurrently. `dependencies` maps every action of the plan to the actions
+    of earlier steps that have to finish before it starts.
+    """
+    steps = attr.ib(type=typing.List[typing.FrozenSet[Action]])
+    dependencies = attr.ib(type=typing.Dict[PlanStep, typing.FrozenSet[PlanStep]])
+
+    @property
+    def actions(self) -> typing.List[Action]:
+        return [
+            action
+            for step in self.steps
+            for action in step
+        ]
+
+    @property
+    def plan_steps(self) -> typing.List[PlanStep]:
+        return [
+            PlanStep(step=index, action=action)
+            for index, step in enumerate(self.steps)
+            for action in step
+        ]
+
+    @classmethod
+    def from_solution(cls, solution: typing.List[typing.Set[Action]]) -> 'LayeredPlan':
+        steps = [
+            frozenset(action for action in step if not action.is_noop)
+            for step in solution
+        ]
+        steps = [step for step in steps if step]
+
+        dependencies = {}
+        # actions of the most recent step that produced a proposition
+        producers = collections.defaultdict(set)
+        previous_steps = []
+
+        for index, step in enumerate(steps):
+            plan_steps = [PlanStep(step=index, action=action) for action in step]
+
+            for plan_step in plan_steps:
+                action = plan_step.action
+                depends_on = set()
+
+                for requirement in action.requirements:
+                    depends_on.update(producers.get(requirement, ()))
+
+                depends_on.update(
+                    previous_step
+                    for previous_step in previous_steps
+                    if _actions_interfere(previous_step.action, action)
+                )
+
+                dependencies[plan_step] = frozenset(depends_on)
+
+            step_producers = collections.defaultdict(set)
+            for plan_step in plan_steps:
+                for effect in plan_step.action.effects:
+                    step_producers[effect].add(plan_step)
+
+            producers.update(step_producers)
+            previous_steps += plan_steps
+
+        return cls(steps=steps, dependencies=dependencies)
+
+
+def _is_mutex(mutex: typing.Mapping, node_a, node_b) -> bool:
+    is_mutex = getattr(mutex, 'is_mutex', None)
+
+    if is_mutex is not None:
+        return is_mutex(node_a, node_b)
+
+    return node_b in mutex.get(node_a, ())
+
+
+def propositions_mutex(
+        mutex_propositions: typing.Mapping[PropositionLabel, typing.AbstractSet[PropositionLabel]],
+        proposition_a: PropositionLabel,
+        proposition_b: PropositionLabel,
+) -> bool:
+    return _is_mutex(mutex_propositions, proposition_a, proposition_b)
+
+
+def _propositions_actions(actions: typing.Iterable[Action]) -> typing.Dict[PropositionLabel, typing.List[Action]]:
+    prop_actions = collections.defaultdict(list)
+
+    for proposition, action in (
+            (proposition, action)
+            for action in actions
+            for proposition in action.effects
+    ):
+        log.debug('Proposition %s - action %s', proposition, action)
+        prop_actions[proposition].append(action)
+
+    return prop_actions
+
+
 class GraphBuilder(object):
+    def __init__(self, lazy_mutex: bool = False):
+        self.lazy_mutex = lazy_mutex
+
     @classmethod
     def _action_requirements_met(cls, state: Layer, action: Action):
         log.debug('Validating action requirements for {}'.format(action.name))
@@ -106,35 +333,21 @@ class GraphBuilder(object):
     def _is_action_mutex(cls, mutex_propositions, action_a: Action, action_b: Action):
         log.debug('Checking mutex conditions for %s, %s', action_a, action_b)
 
-        def opposite_effect(effect: str):
-            match = re.search(r'([^_]*)__unset', effect)
-
-            if match is None:
-                return f'{effect}__unset'
-
-            proposition = match.group(1)
-            return proposition
+        delete_effects = action_a.deletes
 
-        delete_effects = {
-            opposite_effect(effect) for effect in action_a.effects
-        }
-
-        if delete_effects.intersection(action_b.effects):
+        if not delete_effects.isdisjoint(action_b.effects):
             log.debug('Action a deletes an effect of action B. Mutex condition found')
             return True
 
-        if delete_effects.intersection(action_b.requirements):
+        if not delete_effects.isdisjoint(action_b.requirements):
             log.debug('Action a deletes a precondition of action B. Mutex condition found')
             return True
 
-        action_a_requirement_mutex = set()
-        for requirement_proposition in action_a.requirements:
-            action_a_requirement_mutex = action_a_requirement_mutex.union(
-                mutex_propositions.get(requirement_proposition, set())
-            )
-        log.debug('Action a requirement mutex list: %s', action_a_requirement_mutex)
-
-        if action_a_requirement_mutex.intersection(action_b.requirements):
+        if any(
+            propositions_mutex(mutex_propositions, requirement_a, requirement_b)
+            for requirement_a in action_a.requirements
+            for requirement_b in action_b.requirements
+        ):
             log.debug('Action a requirement is mutually exclusive to action b requirements. Mutex condition found')
             return True
 
@@ -145,7 +358,7 @@ class GraphBuilder(object):
             cls,
             previous_state: Layer,
             possible_actions: typing.List[Action],
-    ) -> typing.Dict[Action, typing.Set[Action]]:
+    ) -> typing.Dict[Action, typing.FrozenSet[Action]]:
         mutex = collections.defaultdict(set)
 
         for action, other_action in itertools.permutations(possible_actions, 2):
@@ -153,7 +366,7 @@ class GraphBuilder(object):
                 mutex[action].add(other_action)
                 mutex[other_action].add(action)
 
-        return mutex
+        return _frozen_mutex(mutex)
 
     @classmethod
     def _calculate_propositions(
@@ -173,16 +386,8 @@ class GraphBuilder(object):
             previous_state: Layer,
             actions: typing.List[Action],
             mutex_actions: typing.Dict[Action, typing.Set[Action]],
-    ) -> typing.Dict[PropositionLabel, typing.Set[PropositionLabel]]:
-        prop_actions = collections.defaultdict(list)
-
-        for proposition, action in (
-                (proposition, action)
-                for action in actions
-                for proposition in action.effects
-        ):
-            log.info('Proposition %s - action %s', proposition, action)
-            prop_actions[proposition].append(action)
+    ) -> typing.Dict[PropositionLabel, typing.FrozenSet[PropositionLabel]]:
+        prop_actions = _propositions_actions(actions)
 
         log.info('Mutex actions: %s', mutex_actions)
 
@@ -193,7 +398,7 @@ class GraphBuilder(object):
             log.info('Checking action mutexes for %s - %s', this_prop, mutex_prop)
 
             actions_mutexes = (
-                action_b in mutex_actions[action_a]
+                action_b in mutex_actions.get(action_a, ())
                 for action_a in prop_actions[this_prop]
                 for action_b in prop_actions[mutex_prop]
             )
@@ -203,14 +408,33 @@ class GraphBuilder(object):
                 proposition_mutex[this_prop].add(mutex_prop)
                 proposition_mutex[mutex_prop].add(this_prop)
 
-        return dict(proposition_mutex)
+        return _frozen_mutex(proposition_mutex)
 
     def calculate_next_layer(self, current_state: Layer, available_actions) -> Layer:
         next_actions = self._calculate_actions(current_state, available_actions)
-        mutex_actions = self._calculate_actions_mutex(current_state, next_actions)
         next_propositions = self._calculate_propositions(current_state, next_actions)
+
+        # once the graph levels off, the next layer shares the structures of
+        # the current one instead of holding equal copies
+        if next_propositions == current_state.propositions:
+            next_propositions = current_state.propositions
+
+        if self.lazy_mutex:
+            # mutexes are left to the PlanningGraph the layer is added to,
+            # which computes them pair by pair when they are asked about
+            return Layer(
+                actions=next_actions,
+                mutex_actions=None,
+                propositions=next_propositions,
+                mutex_propositions=None,
+            )
+
+        mutex_actions = self._calculate_actions_mutex(current_state, next_actions)
         mutex_propositions = self._calculate_propositions_mutex(current_state, next_actions, mutex_actions)
 
+        if mutex_propositions == current_state.mutex_propositions:
+            mutex_propositions = current_state.mutex_propositions
+
         return Layer(
             actions=next_actions,
             mutex_actions=mutex_actions,
@@ -232,16 +456,18 @@ class GraphSolver(object):
         propositions = layer.propositions
         mutex_propositions = layer.mutex_propositions
         log.info('Current propositions: %s', propositions)
-        log.info('Current mutex propositions: %s', mutex_propositions)
+        # logging takes the length of a lone Mapping argument, which would
+        # compute every pair of a lazy mutex
+        log.info('Current mutex propositions for goal %s: %s', goal, mutex_propositions)
 
         if not goal.issubset(propositions):
             log.info('not every goal proposition is met')
             return False
 
-        if any((
-            goal.intersection(mutex_propositions.get(proposition, set()))
-            for proposition in goal
-        )):
+        if any(
+            propositions_mutex(mutex_propositions, proposition_a, proposition_b)
+            for proposition_a, proposition_b in itertools.combinations(goal, 2)
+        ):
             log.info('goal propositions are mutex')
             return False
 
@@ -259,7 +485,7 @@ class GraphSolver(object):
         self, action_mutex: typing.Dict['Action', typing.Set['Action']], actions: typing.List[Action]
     ):
         return any(
-            action_b in action_mutex.get(action_a, set())
+            _is_mutex(action_mutex, action_a, action_b)
             for (action_a, action_b) in itertools.combinations(actions, 2)
         )
 
@@ -302,9 +528,40 @@ class GraphSolver(object):
             for proposition in action.requirements
         }
 
-    def search_for_solution(
-        self, layers: typing.List[Layer], goal: typing.Set[PropositionLabel]
-    ) -> typing.List[Action]:
+    def search_for_layered_solution(
+        self,
+        layers: typing.List[Layer],
+        goal: typing.Set[PropositionLabel],
+        nogoods: typing.Optional[typing.Dict[int, typing.Set[typing.FrozenSet[PropositionLabel]]]] = None,
+    ) -> typing.List[typing.Set[Action]]:
+        """
+        `nogoods` is a memo of goals known to be unreachable at a level. It
+        stays valid for as long as the levels it refers to are unchanged, so
+        it can be kept for the whole lifetime of a planning graph.
+        """
+        if nogoods is None:
+            return self._search_for_layered_solution(layers, goal, nogoods)
+
+        level = len(layers) - 1
+        goal_key = frozenset(goal)
+
+        if goal_key in nogoods.get(level, ()):
+            log.info('Goal is a known nogood at level %s', level)
+            raise PlanNotFound()
+
+        try:
+            return self._search_for_layered_solution(layers, goal, nogoods)
+
+        except PlanNotFound:
+            nogoods.setdefault(level, set()).add(goal_key)
+            raise
+
+    def _search_for_layered_solution(
+        self,
+        layers: typing.List[Layer],
+        goal: typing.Set[PropositionLabel],
+        nogoods: typing.Optional[typing.Dict[int, typing.Set[typing.FrozenSet[PropositionLabel]]]],
+    ) -> typing.List[typing.Set[Action]]:
         log.info('Searching for solution for goal: %s', goal)
 
         if goal == set():
@@ -333,115 +590,806 @@ class GraphSolver(object):
             log.info('Sub-goal: %s', sub_goal)
 
             try:
-                subgoal_actions = self.search_for_solution(layers[:-1], sub_goal)
+                subgoal_steps = self.search_for_layered_solution(layers[:-1], sub_goal, nogoods)
 
             except PlanNotFound:
                 log.info('No plan found in action set')
                 continue
 
-            plan_actions = subgoal_actions + list(goal_actions)
+            plan_steps = subgoal_steps + [goal_actions]
             break
 
         else:
             log.info('Ran out of action sets. Solution is not found')
             raise PlanNotFound()
 
-        log.info('Plan is found! %s', plan_actions)
-        return plan_actions
+        log.info('Plan is found! %s', plan_steps)
+        return plan_steps
+
+    def iter_layered_solutions(
+        self,
+        layers: typing.List[Layer],
+        goal: typing.Set[PropositionLabel],
+        nogoods: typing.Optional[typing.Dict[int, typing.Set[typing.FrozenSet[PropositionLabel]]]] = None,
+    ) -> typing.Iterator[typing.List[typing.Set[Action]]]:
+        """
+        Lazily yield every solution in the layers, in the order
+        `search_for_layered_solution` would try them. Goals found to have no
+        solution are added to `nogoods`, the same memo the search uses.
+        """
+        if goal == set():
+            yield []
+            return
+
+        if self._plan_is_stalled(layers):
+            raise PlanNotPossible()
+
+        level = len(layers) - 1
+        goal_key = frozenset(goal)
+
+        if nogoods is not None and goal_key in nogoods.get(level, ()):
+            return
+
+        current_layer = layers[-1]
+        found = False
+
+        if not self._plan_goal_reached(current_layer, goal):
+            log.info('Goal is not reached in the current layer')
+
+        elif not current_layer.actions:
+            found = True
+            yield []
+
+        else:
+            tried = set()
+
+            for goal_actions in self._goal_search_actions(current_layer, goal):
+                # different achiever choices can pick the same action set
+                if frozenset(goal_actions) in tried:
+                    continue
+                tried.add(frozenset(goal_actions))
+
+                sub_goal = self._goal_calculate_subgoal(goal_actions)
+
+                for subgoal_steps in self.iter_layered_solutions(layers[:-1], sub_goal, nogoods):
+                    found = True
+                    yield subgoal_steps + [goal_actions]
+
+        # only reached when the caller consumed every solution
+        if not found and nogoods is not None:
+            nogoods.setdefault(level, set()).add(goal_key)
+
+    def search_for_solution(
+        self, layers: typing.List[Layer], goal: typing.Set[PropositionLabel]
+    ) -> typing.List[Action]:
+        return [
+            action
+            for step in self.search_for_layered_solution(layers, goal)
+            for action in step
+        ]
+
+
+def _mutex_holds(spans: typing.List[typing.List[int]], level: int) -> bool:
+    return any(first <= level <= last for first, last in spans)
+
+
+class _LevelPropositions(collections.abc.Set):
+    def __init__(self, graph: 'PlanningGraph', level: int):
+        self._graph = graph
+        self._level = level
+
+    def __contains__(self, proposition):
+        first_level = self._graph._proposition_levels.get(proposition)
+        return first_level is not None and first_level <= self._level
+
+    def __iter__(self):
+        return itertools.islice(self._graph._propositions, len(self))
+
+    def __len__(self):
+        return self._graph._proposition_counts[self._level]
+
+
+class _LevelActions(collections.abc.Sequence):
+    def __init__(self, graph: 'PlanningGraph', level: int):
+        self._graph = graph
+        self._level = level
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __iter__(self):
+        # noops go first, matching the order GraphBuilder lays out a layer in
+        return itertools.chain(
+            itertools.islice(self._graph._noop_actions, self._graph._noop_action_counts[self._level]),
+            itertools.islice(self._graph._actions, self._graph._action_counts[self._level]),
+        )
+
+    def __len__(self):
+        return self._graph._noop_action_counts[self._level] + self._graph._action_counts[self._level]
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+
+class _LevelMutex(collections.abc.Mapping):
+    def __init__(self, graph: 'PlanningGraph', adjacency: typing.Dict, level: int):
+        self._graph = graph
+        self._adjacency = adjacency
+        self._level = level
+        self._rows = {}
+
+    def __getitem__(self, node):
+        try:
+            return self._rows[node]
+
+        except KeyError:
+            row = frozenset(
+                other
+                for other, spans in self._adjacency.get(node, {}).items()
+                if _mutex_holds(spans, self._level)
+            )
+
+            if not row:
+                raise KeyError(node)
+
+            return self._rows.setdefault(node, row)
+
+    def is_mutex(self, node_a, node_b) -> bool:
+        spans = self._adjacency.get(node_a, {}).get(node_b)
+        return spans is not None and _mutex_holds(spans, self._level)
+
+    def __iter__(self):
+        return (
+            node
+            for node, row in self._adjacency.items()
+            if any(_mutex_holds(spans, self._level) for spans in row.values())
+        )
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class _LazyLevelMutex(collections.abc.Mapping):
+    """
+    Mutexes of a level that was added without them, asked from the graph
+    pair by pair.
+    """
+
+    def __init__(
+            self,
+            nodes: typing.Collection,
+            is_mutex: typing.Callable[[typing.Any, typing.Any, int], bool],
+            level: int,
+    ):
+        self._nodes = nodes
+        self._is_mutex = is_mutex
+        self._level = level
+
+    def is_mutex(self, node_a, node_b) -> bool:
+        return self._is_mutex(node_a, node_b, self._level)
+
+    def __getitem__(self, node):
+        row = frozenset(
+            other
+            for other in self._nodes
+            if self.is_mutex(node, other)
+        )
+
+        if not row:
+            raise KeyError(node)
+
+        return row
+
+    def __iter__(self):
+        return (
+            node
+            for node in self._nodes
+            if any(self.is_mutex(node, other) for other in self._nodes)
+        )
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def describe(self):
+        # describing must not compute the remaining pairs
+        return {'lazy': True, 'level': self._level}
+
+    def __repr__(self):
+        return json.dumps(self.describe())
+
+    def __eq__(self, other):
+        if not (
+                isinstance(other, _LazyLevelMutex)
+                and self._is_mutex == other._is_mutex
+                and len(self._nodes) == len(other._nodes)
+        ):
+            return super().__eq__(other)
+
+        # the same nodes on two levels of one graph: mutexes only disappear
+        # as the graph grows, so the levels differ exactly when a pair that
+        # is mutex on the lower one is not on the upper one, and comparing
+        # stops at the first such pair
+        lower, upper = sorted([self._level, other._level])
+
+        return not any(
+            self._is_mutex(node_a, node_b, lower) and not self._is_mutex(node_a, node_b, upper)
+            for node_a, node_b in itertools.combinations(self._nodes, 2)
+        )
+
+    __hash__ = None
+
+
+def _describe_mutex(mutex: typing.Optional[typing.Mapping]) -> typing.Optional[typing.Dict]:
+    if mutex is None:
+        # left to the PlanningGraph by a lazy GraphBuilder
+        return {'lazy': True}
+
+    if isinstance(mutex, _LazyLevelMutex):
+        return mutex.describe()
+
+    return None
+
+
+class PlanningGraph(object):
+    """
+    Planning graph that stores every proposition and action once, together
+    with the level it first appears at. Mutexes are stored as ranges of
+    levels at which they hold.
+
+    Propositions and actions only ever get added as the graph grows, so the
+    contents of any level are a prefix of the node lists. `layer` returns a
+    `Layer` view over that prefix, which is what `GraphSolver` works with.
+
+    Layers built by a lazy GraphBuilder come without mutexes, and the graph
+    computes those pair by pair when they are asked about. Mutexes only
+    disappear as the graph grows, so a pair of propositions that is mutex
+    on a level is mutex on every earlier level that has both, and one that
+    is not stays so on every later level. A single record per pair,
+    `[last level known mutex, first level known not mutex]`, therefore
+    serves every lazy level.
+    """
+
+    def __init__(self, state: typing.Iterable[PropositionLabel]):
+        self._propositions: typing.List[PropositionLabel] = []
+        self._proposition_levels: typing.Dict[PropositionLabel, int] = {}
+        self._proposition_counts: typing.List[int] = []
+
+        self._noop_actions: typing.List[Action] = []
+        self._actions: typing.List[Action] = []
+        self._action_levels: typing.Dict[Action, int] = {}
+        self._noop_action_counts: typing.List[int] = []
+        self._action_counts: typing.List[int] = []
+
+        self._mutex_propositions: typing.Dict[PropositionLabel, typing.Dict] = {}
+        self._mutex_actions: typing.Dict[Action, typing.Dict] = {}
+
+        self._lazy_levels: typing.Set[int] = set()
+        self._lazy_pairs: typing.Dict[typing.Tuple[PropositionLabel, PropositionLabel], typing.List[int]] = {}
+        # actions producing each proposition, in the order they were added
+        self._producers: typing.Dict[PropositionLabel, typing.List[Action]] = {}
+
+        self._layers: typing.List[Layer] = []
+
+        self.nogoods: typing.Dict[int, typing.Set[typing.FrozenSet[PropositionLabel]]] = {}
+        # set by the first Planner call that expands the graph
+        self.actions_fingerprint: typing.Optional[bytes] = None
+
+        self.add_layer(Layer(
+            actions=[],
+            mutex_actions={},
+            propositions=state,
+            mutex_propositions={},
+        ))
+
+    @property
+    def depth(self) -> int:
+        return len(self._layers) - 1
+
+    def add_layer(self, layer: Layer) -> Layer:
+        level = len(self._layers)
+
+        for proposition in layer.propositions:
+            if proposition not in self._proposition_levels:
+                self._proposition_levels[proposition] = level
+                self._propositions.append(proposition)
+
+        for action in layer.actions:
+            if action not in self._action_levels:
+                self._action_levels[action] = level
+
+                if action.is_noop:
+                    self._noop_actions.append(action)
+                else:
+                    self._actions.append(action)
+
+                for effect in action.effects:
+                    self._producers.setdefault(effect, []).append(action)
+
+        self._proposition_counts.append(len(self._propositions))
+        self._noop_action_counts.append(len(self._noop_actions))
+        self._action_counts.append(len(self._actions))
+
+        if layer.mutex_propositions is None:
+            self._lazy_levels.add(level)
+        else:
+            self._record_mutex(self._mutex_propositions, layer.mutex_propositions, level)
+            self._record_mutex(self._mutex_actions, layer.mutex_actions, level)
+
+        view = self._level_view(level)
+        self._layers.append(view)
+
+        return view
+
+    def _level_view(self, level: int) -> Layer:
+        actions = _LevelActions(self, level)
+        propositions = _LevelPropositions(self, level)
+
+        if level in self._lazy_levels:
+            mutex_actions = _LazyLevelMutex(actions, self.is_actions_mutex, level)
+            mutex_propositions = _LazyLevelMutex(propositions, self.is_propositions_mutex, level)
+        else:
+            mutex_actions = _LevelMutex(self, self._mutex_actions, level)
+            mutex_propositions = _LevelMutex(self, self._mutex_propositions, level)
+
+        return Layer(
+            actions=actions,
+            propositions=propositions,
+            mutex_actions=mutex_actions,
+            mutex_propositions=mutex_propositions,
+        )
+
+    def _materialized_mutex(self) -> typing.Tuple[typing.Dict, typing.Dict]:
+        # span tables of propositions and actions with every lazy level
+        # computed, built aside so the graph itself stays lazy
+        if not self._lazy_levels:
+            return self._mutex_propositions, self._mutex_actions
+
+        mutex_propositions = {}
+        mutex_actions = {}
+
+        for level, layer in enumerate(self._layers):
+            self._record_mutex(mutex_propositions, layer.mutex_propositions, level)
+            self._record_mutex(mutex_actions, layer.mutex_actions, level)
+
+        return mutex_propositions, mutex_actions
+
+    def materialize_mutex(self):
+        """
+        Compute all lazily computed mutexes and store them like eagerly
+        computed ones.
+        """
+        self._mutex_propositions, self._mutex_actions = self._materialized_mutex()
+
+        self._lazy_levels = set()
+        self._lazy_pairs = {}
+        self._layers = [self._level_view(level) for level in range(len(self._layers))]
+
+    @classmethod
+    def _record_mutex(cls, adjacency: typing.Dict, mutex: typing.Mapping, level: int):
+        # both directions of a pair share one list of [first, last] spans
+        for node, others in mutex.items():
+            row = adjacency.setdefault(node, {})
+
+            for other in others:
+                spans = row.get(other)
+
+                if spans is None:
+                    spans = [[level, level]]
+                    row[other] = spans
+                    adjacency.setdefault(other, {})[node] = spans
+
+                elif spans[-1][1] == level - 1:
+                    spans[-1][1] = level
+
+                elif spans[-1][1] < level - 1:
+                    spans.append([level, level])
+
+    def layer(self, level: int) -> Layer:
+        return self._layers[level]
+
+    def layers(self, depth: typing.Optional[int] = None) -> typing.List[Layer]:
+        if depth is None:
+            return list(self._layers)
+
+        return self._layers[:depth + 1]
+
+    def propositions_at(self, level: int) -> typing.AbstractSet[PropositionLabel]:
+        return self._layers[level].propositions
+
+    def actions_at(self, level: int) -> typing.Sequence[Action]:
+        return self._layers[level].actions
+
+    def proposition_level(self, proposition: PropositionLabel) -> typing.Optional[int]:
+        return self._proposition_levels.get(proposition)
+
+    def action_level(self, action: Action) -> typing.Optional[int]:
+        return self._action_levels.get(action)
+
+    def is_propositions_mutex(self, proposition_a: PropositionLabel, proposition_b: PropositionLabel, level: int):
+        if level in self._lazy_levels:
+            return self._lazy_propositions_mutex(proposition_a, proposition_b, level)
+
+        spans = self._mutex_propositions.get(proposition_a, {}).get(proposition_b)
+        return spans is not None and _mutex_holds(spans, level)
+
+    def is_actions_mutex(self, action_a: Action, action_b: Action, level: int):
+        if level in self._lazy_levels:
+            return self._lazy_actions_mutex(action_a, action_b, level)
+
+        spans = self._mutex_actions.get(action_a, {}).get(action_b)
+        return spans is not None and _mutex_holds(spans, level)
+
+    def _lazy_propositions_mutex(self, proposition_a: PropositionLabel, proposition_b: PropositionLabel, level: int):
+        if (
+                proposition_a == proposition_b
+                or proposition_a not in self._layers[level].propositions
+                or proposition_b not in self._layers[level].propositions
+        ):
+            return False
+
+        key = (proposition_a, proposition_b) if proposition_a < proposition_b else (proposition_b, proposition_a)
+        known = self._lazy_pairs.get(key)
+
+        if known is None:
+            known = self._lazy_pairs[key] = [-1, sys.maxsize]
+
+        elif level <= known[0]:
+            return True
+
+        elif level >= known[1]:
+            return False
+
+        mutex = self._compute_propositions_mutex(proposition_a, proposition_b, level)
+
+        if mutex:
+            known[0] = level
+        else:
+            known[1] = level
+
+        return mutex
+
+    def _compute_propositions_mutex(self, proposition_a: PropositionLabel, proposition_b: PropositionLabel, level: int):
+        producers_b = list(self._producers_at(proposition_b, level))
+
+        return all(
+            self.is_actions_mutex(action_a, action_b, level)
+            for action_a in self._producers_at(proposition_a, level)
+            for action_b in producers_b
+        )
+
+    def _lazy_actions_mutex(self, action_a: Action, action_b: Action, level: int):
+        if (
+                action_a == action_b
+                or self._action_levels.get(action_a, level + 1) > level
+                or self._action_levels.get(action_b, level + 1) > level
+        ):
+            return False
+
+        # the same conditions GraphBuilder checks: interference, then
+        # competing needs on the previous level
+        return _actions_interfere(action_a, action_b) or any(
+            self.is_propositions_mutex(requirement_a, requirement_b, level - 1)
+            for requirement_a in action_a.requirements
+            for requirement_b in action_b.requirements
+        )
+
+    def _producers_at(self, proposition: PropositionLabel, level: int) -> typing.Iterator[Action]:
+        return itertools.takewhile(
+            lambda action: self._action_levels[action] <= level,
+            self._producers.get(proposition, ()),
+        )
+
+
+class PropositionIndex(object):
+    """
+    Interns proposition labels to bit positions, so sets of propositions can
+    be stored and combined as integer bitmasks.
+    """
+
+    def __init__(self, propositions: typing.Iterable[PropositionLabel] = ()):
+        self.labels: typing.List[PropositionLabel] = []
+        self._bits: typing.Dict[PropositionLabel, int] = {}
+        self._lock = threading.Lock()
+
+        for proposition in propositions:
+            self.bit(proposition)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, proposition):
+        return proposition in self._bits
+
+    def bit(self, proposition: PropositionLabel) -> int:
+        try:
+            return self._bits[proposition]
+
+        except KeyError:
+            with self._lock:
+                if proposition not in self._bits:
+                    self.labels.append(sys.intern(proposition))
+                    self._bits[proposition] = len(self.labels) - 1
+
+                return self._bits[proposition]
+
+    def mask(self, propositions: typing.Iterable[PropositionLabel]) -> int:
+        mask = 0
+
+        for proposition in propositions:
+            mask |= 1 << self.bit(proposition)
+
+        return mask
+
+    def propositions(self, mask: int) -> typing.Set[PropositionLabel]:
+        propositions = set()
+
+        while mask:
+            lowest = mask & -mask
+            propositions.add(self.labels[lowest.bit_length() - 1])
+            mask ^= lowest
+
+        return propositions
+
+
+class DependencyIndex(object):
+    """
+    Transitive closure of "proposition p is a requirement of an action
+    producing q" over a set of actions. Built once per domain, it answers
+    which propositions a state update invalidates.
+    """
+
+    def __init__(self, actions: typing.Iterable[Action]):
+        self.propositions = PropositionIndex()
+
+        direct = collections.defaultdict(int)
+        for action in actions:
+            effects = self.propositions.mask(action.effects)
+
+            for requirement in action.requirements:
+                direct[self.propositions.bit(requirement)] |= effects
+
+        self._closure: typing.Dict[int, int] = {}
+        for bit in list(direct):
+            closure = 0
+            pending = direct[bit]
+
+            while pending:
+                closure |= pending
+                reached = 0
+
+                remaining = pending
+                while remaining:
+                    lowest = remaining & -remaining
+                    reached |= direct.get(lowest.bit_length() - 1, 0)
+                    remaining ^= lowest
+
+                pending = reached & ~closure
+
+            self._closure[bit] = closure
+
+        # labels looked up later must not grow this set
+        self.relevant: typing.FrozenSet[PropositionLabel] = frozenset(self.propositions.labels)
+
+    def relevant_state(self, state: typing.Iterable[PropositionLabel]) -> typing.Set[PropositionLabel]:
+        """
+        Propositions of `state` that some action requires or produces.
+        """
+        return {proposition for proposition in state if proposition in self.relevant}
+
+    def dependents(self, proposition: PropositionLabel) -> typing.Set[PropositionLabel]:
+        if proposition not in self.propositions:
+            return set()
+
+        return self.propositions.propositions(
+            self._closure.get(self.propositions.bit(proposition), 0)
+        )
+
+    def invalidated(self, update: typing.Iterable[PropositionLabel]) -> typing.Set[PropositionLabel]:
+        mask = 0
+        unknown = set()
+
+        for proposition in update:
+            if proposition in self.propositions:
+                bit = self.propositions.bit(proposition)
+                mask |= (1 << bit) | self._closure.get(bit, 0)
+            else:
+                unknown.add(proposition)
+
+        return self.propositions.propositions(mask) | unknown
 
 
 class Planner(object):
-    def __init__(self):
-        self.graph_builder = GraphBuilder()
+    def __init__(self, lazy_mutex: bool = False, cache_size: int = 16):
+        self.graph_builder = GraphBuilder(lazy_mutex=lazy_mutex)
         self.graph_solver = GraphSolver()
+        self.cache_size = cache_size
+        self._dependency_indexes: typing.Dict[typing.FrozenSet[Action], DependencyIndex] = {}
+        self._actions_fingerprints: typing.Dict[typing.FrozenSet[Action], bytes] = {}
+        self._cache_lock = threading.Lock()
+
+    def _cached(self, cache: typing.Dict, actions: typing.FrozenSet[Action], build: typing.Callable):
+        try:
+            return cache[actions]
+
+        except KeyError:
+            # built under the lock so that concurrent callers do not all
+            # build the same entry
+            with self._cache_lock:
+                if actions not in cache:
+                    # dicts keep insertion order, the oldest entry goes first
+                    while cache and len(cache) >= self.cache_size:
+                        del cache[next(iter(cache))]
+
+                    cache[actions] = build(actions)
+
+                return cache[actions]
+
+    def dependency_index(self, actions: typing.Iterable[Action]) -> DependencyIndex:
+        # a frozenset is reused as it is and caches its hash, so long-lived
+        # callers that keep their actions in one look the index up in
+        # constant time
+        return self._cached(self._dependency_indexes, frozenset(actions), DependencyIndex)
+
+    def actions_fingerprint(self, actions: typing.Iterable[Action]) -> bytes:
+        return self._cached(self._actions_fingerprints, frozenset(actions), actions_fingerprint)
 
     def plan(
             self,
             state: typing.Set[PropositionLabel],
             goal: typing.Set[PropositionLabel],
             actions: typing.Set[Action],
+            graph: typing.Optional[PlanningGraph] = None,
     ) -> typing.List[Action]:
+        return [
+            action
+            for step in self._search(state, goal, actions, graph)
+            for action in step
+            if not action.is_noop
+        ]
+
+    def plan_layered(
+            self,
+            state: typing.Set[PropositionLabel],
+            goal: typing.Set[PropositionLabel],
+            actions: typing.Set[Action],
+            graph: typing.Optional[PlanningGraph] = None,
+    ) -> LayeredPlan:
+        return LayeredPlan.from_solution(self._search(state, goal, actions, graph))
+
+    def iter_plans(
+            self,
+            state: typing.Set[PropositionLabel],
+            goal: typing.Set[PropositionLabel],
+            actions: typing.Set[Action],
+            max_levels: typing.Optional[int] = None,
+    ) -> typing.Iterator[typing.List[Action]]:
+        """
+        Lazily yield distinct plans, shortest (in parallel steps) first, from
+        a single planning graph. Enumeration stops once the graph levels off
+        or reaches `max_levels`; the caller can stop it at any point.
+        """
+        graph = PlanningGraph(state)
+        current_layer = graph.layer(0)
+        seen = set()
+
+        while max_levels is None or graph.depth < max_levels:
+            current_layer = self.graph_builder.calculate_next_layer(current_layer, actions)
+            graph.add_layer(current_layer)
+
+            try:
+                for solution in self.graph_solver.iter_layered_solutions(graph.layers(), goal, graph.nogoods):
+                    plan = [
+                        action
+                        for step in solution
+                        for action in step
+                        if not action.is_noop
+                    ]
+
+                    if tuple(plan) not in seen:
+                        seen.add(tuple(plan))
+                        yield plan
+
+            except PlanNotPossible:
+                log.info('Planning graph has levelled off, no more plans')
+                return
+
+    def _search(
+            self,
+            state: typing.Set[PropositionLabel],
+            goal: typing.Set[PropositionLabel],
+            actions: typing.Set[Action],
+            graph: typing.Optional[PlanningGraph] = None,
+    ) -> typing.List[typing.Set[Action]]:
+        """
+        Search for a plan, expanding `graph` as needed. Passing a graph built
+        earlier for the same state and actions (for example one loaded from
+        a snapshot) reuses its levels and nogoods.
+        """
         log.info('Starting to search for plan')
 
-        layers = [
-            Layer(
-                actions=[],
-                mutex_actions={},
-                propositions=state,
-                mutex_propositions={},
-            )
-        ]
+        if graph is None:
+            graph = PlanningGraph(state)
+
+        else:
+            if graph.propositions_at(0) != state:
+                raise ValueError('Planning graph was built for a different state')
+
+            fingerprint = self.actions_fingerprint(actions)
+
+            if graph.actions_fingerprint is None:
+                graph.actions_fingerprint = fingerprint
+            elif graph.actions_fingerprint != fingerprint:
+                raise ValueError('Planning graph was built for different actions')
 
-        plan_found = False
-        plan = None
+        current_layer = graph.layer(graph.depth)
+        level = 1
 
-        while not plan_found:
-            log.info('Attempting to find solution by adding a layer')
-            current_layer = layers[-1]
+        # levels the graph already has are searched in order, the same way a
+        # fresh graph would be, so a warm graph that has levelled off for one
+        # goal still finds shallower plans for another
+        while True:
+            if level > graph.depth:
+                log.info('Attempting to find solution by adding a layer')
 
-            log.info('Current layer: %s', current_layer)
-            next_layer = self.graph_builder.calculate_next_layer(current_layer, actions)
+                log.info('Current layer: %s', current_layer)
+                # only the most recent full layer is kept around, everything
+                # earlier lives in the graph
+                current_layer = self.graph_builder.calculate_next_layer(current_layer, actions)
 
-            log.info('Next layer: %s', next_layer)
-            layers += [next_layer]
+                log.info('Next layer: %s', current_layer)
+                graph.add_layer(current_layer)
 
             try:
-                log.info('Searching for plan in current layers')
-                plan = self.graph_solver.search_for_solution(layers, goal)
-                plan_found = True
+                log.info('Searching for plan in layers up to level %s', level)
+                return self.graph_solver.search_for_layered_solution(graph.layers(level), goal, graph.nogoods)
 
             except PlanNotFound:
-                log.info('Plan not found in current layers')
-                continue
+                log.info('Plan not found in layers up to level %s', level)
 
             except PlanNotPossible:
-                log.info('Plan is not possible')
-                break
+                log.info('Plan does not seem to be possible')
+                raise PlanNotPossible
 
-        if not plan_found or plan is None:
-            log.info('Plan does not seem to be possible')
-            raise PlanNotPossible
+            level += 1
 
-        return [
-            action
-            for action in plan
-            if not action.name.startswith('noop_')
-        ]
-
-    def plan_state_update(
+    def relevant_state(
             self,
             state: typing.Set[PropositionLabel],
-            update: typing.Set[PropositionLabel],
             actions: typing.Set[Action],
-    ) -> typing.List[Action]:
-        log.info('Calculating propositions that could be meaningful to the plan')
-        plan_props = {
-            prop
-            for action in actions
-            for prop in action.requirements.union(action.effects)
-        }
-        log.info('Plan relevant propositions: %s', plan_props)
-
+    ) -> typing.Set[PropositionLabel]:
         log.info('Filtering state to only include plan-relevant props')
-        state = {
-            prop
-            for prop in state
-            if prop in plan_props
-        }
+        state = self.dependency_index(actions).relevant_state(state)
         log.info('Filtered state: %s', state)
 
-        log.info('Calculating effects that depend on propositions in state update')
-        dependent_effects = {
-            prop
-            for action in actions
-            for prop in action.effects
-            if update.intersection(action.requirements)
-        }
-        log.info('Dependent effects: %s', dependent_effects)
+        return state
 
-        invalidated_propositions = update.union(dependent_effects)
+    def invalidated_propositions(
+            self,
+            update: typing.Set[PropositionLabel],
+            actions: typing.Set[Action],
+    ) -> typing.Set[PropositionLabel]:
+        log.info('Calculating effects that depend on propositions in state update')
+        invalidated_propositions = self.dependency_index(actions).invalidated(update)
         log.info('Invalidated effects: %s', invalidated_propositions)
 
+        return invalidated_propositions
+
+    def plan_state_update(
+            self,
+            state: typing.Set[PropositionLabel],
+            update: typing.Set[PropositionLabel],
+            actions: typing.Set[Action],
+    ) -> typing.List[Action]:
+        actions = frozenset(actions)
+        state = self.relevant_state(state, actions)
+
+        invalidated_propositions = self.invalidated_propositions(update, actions)
+
         log.info('Updating state by removing invalidated effects')
         original_state = state
         state = state.difference(invalidated_propositions)
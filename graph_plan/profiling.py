@@ -0,0 +1,206 @@
+"""
+Per-phase profiling of a planning run: domain loading, graph expansion
+and backward search each get their own cProfile hotspots and tracemalloc
+allocation counts.
+"""
+import contextlib
+import cProfile
+import functools
+import io
+import pstats
+import time
+import tracemalloc
+import typing
+
+import attr
+
+from graph_plan.domain import load_domain
+from graph_plan.planner import Planner, PlanNotPossible, PropositionLabel
+
+
+PHASES = ('load', 'build', 'search')
+
+# allocations made by the profiler itself are left out of the counts
+_IGNORED_FILES = (tracemalloc.__file__, cProfile.__file__, contextlib.__file__, __file__)
+
+
+@attr.s(slots=True)
+class PhaseProfile(object):
+    name = attr.ib(type=str)
+    profile = attr.ib(type=cProfile.Profile, factory=cProfile.Profile)
+    calls = attr.ib(type=int, default=0)
+    seconds = attr.ib(type=float, default=0.0)
+    allocated_blocks = attr.ib(type=int, default=0)
+    allocated_bytes = attr.ib(type=int, default=0)
+    allocation_sites = attr.ib(type=typing.Dict[str, typing.List[int]], factory=dict)
+
+    def hotspots(self, top: int = 15) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(top)
+        return stream.getvalue()
+
+    def top_allocation_sites(self, top: int = 10) -> typing.List[typing.Tuple[str, int, int]]:
+        return sorted(
+            ((site, blocks, size) for site, (blocks, size) in self.allocation_sites.items()),
+            key=lambda site: site[2],
+            reverse=True,
+        )[:top]
+
+
+class Profiler(object):
+    """
+    Collects a PhaseProfile per phase. Code runs inside `phase(name)`, or
+    through functions wrapped with `wrap(name, function)`.
+
+    With `allocations` on, tracemalloc snapshots are diffed around every
+    phase. That slows the run down considerably, so timings are only
+    comparable between runs with the same setting.
+    """
+
+    def __init__(self, allocations: bool = True):
+        self.allocations = allocations
+        self.phases: typing.Dict[str, PhaseProfile] = {}
+        self.peak_bytes = 0
+        self._active: typing.Set[str] = set()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, filename) for filename in _IGNORED_FILES
+        ])
+
+    def _record_allocations(self, phase: PhaseProfile, before: tracemalloc.Snapshot):
+        for stat in self._snapshot().compare_to(before, 'lineno'):
+            if stat.count_diff <= 0 or stat.size_diff <= 0:
+                continue
+
+            phase.allocated_blocks += stat.count_diff
+            phase.allocated_bytes += stat.size_diff
+
+            frame = stat.traceback[0]
+            site = phase.allocation_sites.setdefault(f'{frame.filename}:{frame.lineno}', [0, 0])
+            site[0] += stat.count_diff
+            site[1] += stat.size_diff
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        phase = self.phases.setdefault(name, PhaseProfile(name=name))
+
+        # recursive calls are already covered by the outermost one
+        if name in self._active:
+            yield phase
+            return
+
+        self._active.add(name)
+        phase.calls += 1
+
+        before = self._snapshot() if self.allocations else None
+
+        started_at = time.perf_counter()
+        phase.profile.enable()
+
+        try:
+            yield phase
+
+        finally:
+            phase.profile.disable()
+            phase.seconds += time.perf_counter() - started_at
+            self._active.discard(name)
+
+            if before is not None:
+                self._record_allocations(phase, before)
+                self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1])
+
+    def wrap(self, name: str, function: typing.Callable) -> typing.Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def tracing(self):
+        if not self.allocations or tracemalloc.is_tracing():
+            yield
+            return
+
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            tracemalloc.stop()
+
+    def report(self, top: int = 15) -> str:
+        lines = []
+
+        for name in sorted(self.phases, key=lambda name: (PHASES + (name,)).index(name)):
+            phase = self.phases[name]
+
+            lines.append(f'== {name}: {phase.calls} calls, {phase.seconds * 1000:.1f} ms ==')
+
+            if self.allocations:
+                lines.append(
+                    f'allocated {phase.allocated_blocks} blocks, {phase.allocated_bytes / 1024:.1f} KiB'
+                )
+
+                for site, blocks, size in phase.top_allocation_sites(top):
+                    lines.append(f'  {size / 1024:10.1f} KiB {blocks:8d} blocks  {site}')
+
+            lines.append(phase.hotspots(top))
+
+        if self.allocations:
+            lines.append(f'peak traced memory: {self.peak_bytes / 1024:.1f} KiB')
+
+        return '\n'.join(lines)
+
+
+def profile_plan(
+        profiler: Profiler,
+        state: typing.Set[PropositionLabel],
+        goal: typing.Set[PropositionLabel],
+        actions: typing.Set,
+        planner: typing.Optional[Planner] = None,
+) -> typing.Optional[typing.List]:
+    """
+    Plan with `planner`, attributing graph expansion to the `build` phase
+    and backward search to the `search` phase. Returns None when no plan
+    exists.
+    """
+    planner = planner or Planner()
+
+    # instance attributes shadow the methods for this planner only
+    planner.graph_builder.calculate_next_layer = profiler.wrap(
+        'build', planner.graph_builder.calculate_next_layer,
+    )
+    planner.graph_solver.search_for_layered_solution = profiler.wrap(
+        'search', planner.graph_solver.search_for_layered_solution,
+    )
+
+    try:
+        return planner.plan(state, goal, actions)
+
+    except PlanNotPossible:
+        return None
+
+    finally:
+        del planner.graph_builder.calculate_next_layer
+        del planner.graph_solver.search_for_layered_solution
+
+
+def profile_domain(
+        path: str,
+        state: typing.Set[PropositionLabel],
+        goal: typing.Set[PropositionLabel],
+        allocations: bool = True,
+        lazy_mutex: bool = False,
+) -> typing.Tuple[Profiler, typing.Optional[typing.List]]:
+    profiler = Profiler(allocations=allocations)
+
+    with profiler.tracing():
+        with profiler.phase('load'):
+            domain = load_domain(path)
+
+        plan = profile_plan(profiler, state, goal, set(domain.actions), Planner(lazy_mutex=lazy_mutex))
+
+    return profiler, plan
@@ -0,0 +1,315 @@
+"""
+Long-running planning service: keeps a domain and a result cache warm and
+answers plan requests from a JSONL batch stream or over local HTTP.
+
+Request:
+
+    {"id": ..., "state": [...] | "world": {...}, "goal": [...]}
+    {"id": ..., "state": [...] | "world": {...}, "update": [...]}
+
+`update` requests go through `Planner.plan_state_update`. Setting
+`"layered": true` adds the parallel steps of the plan to the response.
+"""
+import bisect
+import collections
+import collections.abc
+import concurrent.futures
+import http.server
+import json
+import logging
+import threading
+import time
+import typing
+
+from graph_plan.domain import Domain
+from graph_plan.planner import Planner, PlanNotPossible, state_from_world
+
+
+log = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class RequestError(ValueError):
+    pass
+
+
+# cached in place of a response when no plan exists
+_NOT_POSSIBLE = object()
+
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._latency_total_ms = 0.0
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe_latency(self, seconds: float):
+        latency_ms = seconds * 1000
+
+        with self._lock:
+            self._latency_buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+            self._latency_total_ms += latency_ms
+
+    def describe(self) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            buckets = list(self._latency_buckets)
+            latency_total_ms = self._latency_total_ms
+
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+
+        return {
+            'counters': counters,
+            'cache_hit_rate': counters.get('cache_hits', 0) / lookups if lookups else 0.0,
+            'latency_ms': {
+                'buckets': {
+                    str(bound): count
+                    for bound, count in zip(LATENCY_BUCKETS_MS + ('inf',), buckets)
+                },
+                'count': sum(buckets),
+                'total': latency_total_ms,
+            },
+        }
+
+
+class PlanningService(object):
+    def __init__(self, domain: Domain, planner: typing.Optional[Planner] = None, cache_size: int = 4096):
+        self.domain = domain
+        self.actions = frozenset(domain.actions)
+        self.planner = planner or Planner()
+        self.metrics = Metrics()
+
+        self.cache_size = cache_size
+        self._cache: typing.MutableMapping = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # warm the per-domain caches before the first request comes in
+        self.planner.dependency_index(self.actions)
+
+    def _cached(self, key, compute: typing.Callable[[], typing.Any]):
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.metrics.count('cache_hits')
+                result = self._cache[key]
+
+                if result is _NOT_POSSIBLE:
+                    raise PlanNotPossible()
+
+                return result
+
+        self.metrics.count('cache_misses')
+        self.metrics.count('searches')
+
+        # unsolvable requests are the most expensive ones, so the verdict is
+        # cached as well
+        try:
+            result = compute()
+
+        except PlanNotPossible:
+            result = _NOT_POSSIBLE
+
+        with self._cache_lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        if result is _NOT_POSSIBLE:
+            raise PlanNotPossible()
+
+        return result
+
+    @classmethod
+    def _labels(cls, request: typing.Mapping, key: str) -> typing.FrozenSet[str]:
+        labels = request.get(key, ())
+
+        if not isinstance(labels, (list, tuple)) or not all(isinstance(label, str) for label in labels):
+            raise RequestError(f'{key} must be a list of strings')
+
+        return frozenset(labels)
+
+    @classmethod
+    def _state(cls, request: typing.Mapping) -> typing.FrozenSet[str]:
+        if 'world' in request:
+            world = request['world']
+
+            if not isinstance(world, collections.abc.Mapping) or not all(isinstance(key, str) for key in world):
+                raise RequestError('world must be an object')
+
+            return frozenset(state_from_world(world))
+
+        return cls._labels(request, 'state')
+
+    def _plan(self, request: typing.Mapping) -> typing.Dict[str, typing.Any]:
+        state = self._state(request)
+        layered = request.get('layered', False)
+
+        if not isinstance(layered, bool):
+            raise RequestError('layered must be a boolean')
+
+        if 'update' in request:
+            update = self._labels(request, 'update')
+
+            def compute():
+                return {
+                    'plan': [
+                        action.name
+                        for action in self.planner.plan_state_update(set(state), set(update), self.actions)
+                    ],
+                }
+
+            return self._cached(('update', state, update), compute)
+
+        if 'goal' not in request:
+            raise RequestError('Request needs either a goal or an update')
+
+        goal = self._labels(request, 'goal')
+
+        def compute():
+            result = self.planner.plan_layered(set(state), set(goal), self.actions)
+            response = {'plan': [action.name for action in result.actions]}
+
+            if layered:
+                response['steps'] = [sorted(action.name for action in step) for step in result.steps]
+
+            return response
+
+        return self._cached(('plan', state, goal, layered), compute)
+
+    def handle(self, request: typing.Mapping) -> typing.Dict[str, typing.Any]:
+        started_at = time.monotonic()
+        self.metrics.count('requests')
+
+        response = {'id': None}
+
+        try:
+            if not isinstance(request, collections.abc.Mapping):
+                raise RequestError('Request must be a JSON object')
+
+            response['id'] = request.get('id')
+            response.update(self._plan(request))
+
+        except PlanNotPossible:
+            self.metrics.count('plans_not_possible')
+            response['error'] = 'plan not possible'
+
+        except RequestError as error:
+            self.metrics.count('errors')
+            response['error'] = str(error)
+
+        except Exception as error:
+            # one bad request must not take down a batch run or a connection
+            log.exception('Failed to handle request %s', response['id'])
+            self.metrics.count('errors')
+            response['error'] = f'internal error: {error!r}'
+
+        self.metrics.observe_latency(time.monotonic() - started_at)
+
+        return response
+
+    def handle_line(self, line: str) -> typing.Dict[str, typing.Any]:
+        try:
+            request = json.loads(line)
+
+        except ValueError as error:
+            self.metrics.count('errors')
+            return {'id': None, 'error': f'invalid JSON: {error}'}
+
+        return self.handle(request)
+
+
+def run_batch(
+        service: PlanningService,
+        input_stream: typing.TextIO,
+        output_stream: typing.TextIO,
+        max_workers: int = 8,
+):
+    """
+    Answer JSONL requests from `input_stream`, writing one response per line
+    to `output_stream` in request order.
+    """
+    # only a bounded window of requests is in flight, so responses start
+    # coming out before the input is exhausted
+    window = collections.deque()
+
+    def write(future):
+        output_stream.write(json.dumps(future.result()) + '\n')
+        output_stream.flush()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for line in input_stream:
+            if not line.strip():
+                continue
+
+            window.append(pool.submit(service.handle_line, line))
+
+            if len(window) >= 4 * max_workers:
+                write(window.popleft())
+
+        while window:
+            write(window.popleft())
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    service: PlanningService
+
+    def _respond(self, status: int, body: typing.Mapping):
+        payload = json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._respond(200, self.service.metrics.describe())
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/plan':
+            self._respond(404, {'error': 'not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError(length)
+
+        except ValueError:
+            self.service.metrics.count('errors')
+            self._respond(400, {'id': None, 'error': 'invalid Content-Length'})
+            return
+
+        try:
+            line = self.rfile.read(length).decode('utf-8')
+
+        except UnicodeDecodeError:
+            self.service.metrics.count('errors')
+            self._respond(400, {'id': None, 'error': 'request is not UTF-8'})
+            return
+
+        self._respond(200, self.service.handle_line(line))
+
+    def log_message(self, format, *args):
+        log.info('%s - %s', self.address_string(), format % args)
+
+
+def make_http_server(
+        service: PlanningService, host: str = '127.0.0.1', port: int = 8080
+) -> http.server.ThreadingHTTPServer:
+    """
+    HTTP front-end: `POST /plan` takes a request, `GET /metrics` returns
+    counters, cache hit rate and the latency histogram.
+    """
+    handler = type('RequestHandler', (_RequestHandler,), {'service': service})
+    return http.server.ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,121 @@
+import logging
+import typing
+
+from graph_plan.planner import Action, Planner, PlanNotPossible, PropositionLabel
+
+
+log = logging.getLogger(__name__)
+
+
+class PlanSession(object):
+    """
+    Keeps the state of a host and the plan that restores it while world
+    change events come in.
+
+    Every update removes the propositions it invalidates from the current
+    state. The part of the current plan that can still run from the new state
+    is kept, and only the rest of the way to the goal gets replanned. Plans
+    from states seen before are served from a memo table.
+
+    A session is not thread-safe; feed it from one thread or task.
+    """
+
+    def __init__(
+            self,
+            state: typing.Set[PropositionLabel],
+            actions: typing.Set[Action],
+            planner: typing.Optional[Planner] = None,
+    ):
+        self.planner = planner or Planner()
+        self.actions = frozenset(actions)
+
+        self.goal = frozenset(self.planner.relevant_state(state, self.actions))
+        self.state = self.goal
+        self.plan: typing.List[Action] = []
+
+        self._plans: typing.Dict[typing.FrozenSet[PropositionLabel], typing.List[Action]] = {
+            self.goal: [],
+        }
+
+    def _plan_from(self, state: typing.FrozenSet[PropositionLabel]) -> typing.List[Action]:
+        try:
+            return list(self._plans[state])
+
+        except KeyError:
+            plan = self.planner.plan(state, goal=self.goal, actions=self.actions)
+            self._plans[state] = plan
+            return list(plan)
+
+    def _repair(self, state: typing.FrozenSet[PropositionLabel]) -> typing.List[Action]:
+        log.info('Repairing plan from state: %s', state)
+
+        kept = []
+        reached = state
+
+        for action in self.plan:
+            if not action.requirements.issubset(reached):
+                break
+
+            kept.append(action)
+            reached = action.apply(reached)
+
+        log.info('Keeping plan prefix: %s', kept)
+
+        if self.goal.issubset(reached):
+            return kept
+
+        return kept + self._plan_from(reached)
+
+    def update(self, update: typing.Set[PropositionLabel]) -> typing.List[Action]:
+        """
+        Apply a world change and return the repaired plan. Raises
+        PlanNotPossible when the goal cannot be reached from the new state,
+        in which case the session keeps its previous state and plan.
+        """
+        invalidated = self.planner.invalidated_propositions(set(update), self.actions)
+        state = self.state.difference(invalidated)
+
+        if state == self.state:
+            log.info('Update does not invalidate anything new, keeping the plan')
+            return list(self.plan)
+
+        plan = self._repair(state)
+        self.state, self.plan = state, plan
+
+        return list(self.plan)
+
+    def complete(self, action: Action):
+        """
+        Record that `action` was executed, moving the session state forward.
+        """
+        self.state = action.apply(self.state)
+
+        if self.plan and self.plan[0] == action:
+            self.plan = self.plan[1:]
+        else:
+            self.plan = self._repair(self.state)
+
+    def _try_update(self, update: typing.Set[PropositionLabel]) -> typing.Optional[typing.List[Action]]:
+        try:
+            return self.update(update)
+
+        except PlanNotPossible:
+            log.info('Goal cannot be reached after update: %s', update)
+            return None
+
+    def stream(
+            self, updates: typing.Iterable[typing.Set[PropositionLabel]]
+    ) -> typing.Iterator[typing.Optional[typing.List[Action]]]:
+        """
+        Yield the repaired plan after every update, or None for an update
+        after which the goal cannot be reached. The stream goes on with the
+        next update either way.
+        """
+        for update in updates:
+            yield self._try_update(update)
+
+    async def astream(
+            self, updates: typing.AsyncIterable[typing.Set[PropositionLabel]]
+    ) -> typing.AsyncIterator[typing.Optional[typing.List[Action]]]:
+        async for update in updates:
+            yield self._try_update(update)
@@ -0,0 +1,312 @@
+"""
+Binary snapshots of a PlanningGraph: levels, nodes, mutexes, nogoods and
+the fingerprint of the actions it was built from.
+
+A snapshot is written once (for example for a common initial state) and
+then either loaded back into a PlanningGraph that the planner can keep
+expanding, or accessed read-only through SnapshotReader, which memory-maps
+the file and decodes only what is asked for.
+"""
+import array
+import bisect
+import mmap
+import os
+import struct
+import typing
+
+from graph_plan import _binary
+from graph_plan.planner import Action, PlanningGraph, PropositionLabel
+
+
+MAGIC = b'GPGRAPH\0'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<8sHI32s')
+
+
+class SnapshotFormatError(ValueError):
+    pass
+
+
+def _pack_spans(adjacency: typing.Mapping, indexes: typing.Mapping) -> bytes:
+    spans = sorted(
+        (indexes[node], indexes[other], first, last)
+        for node, row in adjacency.items()
+        for other, node_spans in row.items()
+        if indexes[node] < indexes[other]
+        for first, last in node_spans
+    )
+
+    return _binary.pack_array(array.array('I', [value for span in spans for value in span]))
+
+
+def dump_graph(graph: PlanningGraph) -> bytes:
+    # snapshots are a friend of PlanningGraph and read its internals directly
+    mutex_propositions, mutex_actions = graph._materialized_mutex()
+
+    labels = list(graph._propositions)
+    label_indexes = {label: index for index, label in enumerate(labels)}
+
+    for goals in graph.nogoods.values():
+        for goal in goals:
+            for proposition in goal:
+                if proposition not in label_indexes:
+                    label_indexes[proposition] = len(labels)
+                    labels.append(proposition)
+
+    actions = graph._noop_actions + graph._actions
+    action_indexes = {action: index for index, action in enumerate(actions)}
+
+    nogood_levels = []
+    nogood_goals = []
+    for level, goals in sorted(graph.nogoods.items()):
+        for goal in goals:
+            nogood_levels.append(level)
+            nogood_goals.append(label_indexes[proposition] for proposition in goal)
+
+    sections = [
+        _binary.pack_strings(labels),
+        _binary.pack_array(array.array('I', graph._proposition_counts)),
+        _binary.pack_array(array.array('I', [
+            label_indexes[next(iter(action.effects))] for action in graph._noop_actions
+        ])),
+        _binary.pack_array(array.array('I', graph._noop_action_counts)),
+        _binary.pack_strings(action.name for action in graph._actions),
+        _binary.pack_csr(
+            (label_indexes[label] for label in action.requirements)
+            for action in graph._actions
+        ),
+        _binary.pack_csr(
+            (label_indexes[label] for label in action.effects)
+            for action in graph._actions
+        ),
+        _binary.pack_array(array.array('I', graph._action_counts)),
+        _pack_spans(mutex_propositions, label_indexes),
+        _pack_spans(mutex_actions, action_indexes),
+        _binary.pack_array(array.array('I', nogood_levels)),
+        _binary.pack_csr(nogood_goals),
+    ]
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, graph.depth, graph.actions_fingerprint or b'')
+
+    return header + b''.join(sections)
+
+
+def _read_header(data: memoryview) -> typing.Tuple[int, typing.Optional[bytes], _binary.Reader]:
+    if len(data) < _HEADER.size:
+        raise SnapshotFormatError('Snapshot is truncated')
+
+    magic, version, depth, fingerprint = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotFormatError('Not a planning graph snapshot')
+    if version != FORMAT_VERSION:
+        raise SnapshotFormatError(f'Unsupported snapshot version {version}')
+
+    # all zeroes when the graph was never expanded by a Planner
+    fingerprint = fingerprint if any(fingerprint) else None
+
+    return depth, fingerprint, _binary.Reader(data, _HEADER.size, error=SnapshotFormatError)
+
+
+def _restore_spans(adjacency: typing.Dict, nodes: typing.Sequence, spans: typing.Sequence[int]):
+    for offset in range(0, len(spans), 4):
+        node, other, first, last = spans[offset:offset + 4]
+        node, other = nodes[node], nodes[other]
+
+        node_spans = adjacency.setdefault(node, {}).get(other)
+        if node_spans is None:
+            node_spans = []
+            adjacency[node][other] = node_spans
+            adjacency.setdefault(other, {})[node] = node_spans
+
+        node_spans.append([first, last])
+
+
+def _load_graph(data: memoryview) -> PlanningGraph:
+    depth, fingerprint, reader = _read_header(data)
+
+    labels = reader.strings()
+    proposition_counts = reader.array('I').tolist()
+    noop_propositions = reader.array('I').tolist()
+    noop_action_counts = reader.array('I').tolist()
+    names = reader.strings()
+    requirements = reader.csr()
+    effects = reader.csr()
+    action_counts = reader.array('I').tolist()
+    proposition_spans = reader.array('I').tolist()
+    action_spans = reader.array('I').tolist()
+    nogood_levels = reader.array('I').tolist()
+    nogood_goals = reader.csr()
+
+    if not len(proposition_counts) == len(noop_action_counts) == len(action_counts) == depth + 1:
+        raise SnapshotFormatError('Snapshot level tables are inconsistent')
+
+    graph = PlanningGraph.__new__(PlanningGraph)
+
+    graph._propositions = labels[:proposition_counts[-1]]
+    graph._proposition_levels = {}
+    graph._proposition_counts = proposition_counts
+
+    graph._noop_actions = [Action.noop_action(labels[index]) for index in noop_propositions]
+    graph._actions = [
+        Action(
+            name=name,
+            requirements=frozenset([labels[index] for index in requirements[action_index]]),
+            effects=frozenset([labels[index] for index in effects[action_index]]),
+        )
+        for action_index, name in enumerate(names)
+    ]
+    graph._action_levels = {}
+    graph._noop_action_counts = noop_action_counts
+    graph._action_counts = action_counts
+
+    for level in range(depth, -1, -1):
+        for proposition in graph._propositions[:proposition_counts[level]]:
+            graph._proposition_levels[proposition] = level
+        for action in graph._noop_actions[:noop_action_counts[level]]:
+            graph._action_levels[action] = level
+        for action in graph._actions[:action_counts[level]]:
+            graph._action_levels[action] = level
+
+    graph._producers = {}
+    for action in sorted(graph._noop_actions + graph._actions, key=graph._action_levels.__getitem__):
+        for effect in action.effects:
+            graph._producers.setdefault(effect, []).append(action)
+
+    graph._mutex_propositions = {}
+    graph._mutex_actions = {}
+    graph._lazy_levels = set()
+    graph._lazy_pairs = {}
+    _restore_spans(graph._mutex_propositions, labels, proposition_spans)
+    _restore_spans(graph._mutex_actions, graph._noop_actions + graph._actions, action_spans)
+
+    graph.actions_fingerprint = fingerprint
+    graph.nogoods = {}
+    for level, goal in zip(nogood_levels, nogood_goals):
+        graph.nogoods.setdefault(level, set()).add(frozenset(labels[index] for index in goal))
+
+    graph._layers = [graph._level_view(level) for level in range(depth + 1)]
+
+    return graph
+
+
+def load_graph(data: typing.Union[bytes, memoryview, mmap.mmap]) -> PlanningGraph:
+    with memoryview(data) as view:
+        return _load_graph(view)
+
+
+def write_snapshot(graph: PlanningGraph, path: str):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    try:
+        with open(tmp_path, 'wb') as snapshot_file:
+            snapshot_file.write(dump_graph(graph))
+
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+
+def read_snapshot(path: str) -> PlanningGraph:
+    with SnapshotReader(path) as reader:
+        return reader.load()
+
+
+class SnapshotReader(object):
+    """
+    Read-only access to a snapshot file through mmap. Several processes
+    reading the same snapshot share its pages.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._data = memoryview(self._mmap)
+        self.depth, self.actions_fingerprint, reader = _read_header(self._data)
+
+        self._label_offsets = reader.view('I')
+        self._label_blob = reader.view('B')
+        self._proposition_counts = reader.view('I')
+
+        # skip to the mutex tables, nodes other than propositions are only
+        # decoded by `load`
+        reader.array('I')
+        reader.array('I')
+        reader.strings()
+        reader.csr()
+        reader.csr()
+        reader.array('I')
+
+        self._proposition_spans = reader.view('I')
+        self._proposition_indexes: typing.Optional[typing.Dict[PropositionLabel, int]] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for view in (self._label_offsets, self._label_blob, self._proposition_counts, self._proposition_spans):
+            if isinstance(view, memoryview):
+                view.release()
+
+        self._data.release()
+        self._mmap.close()
+
+    def load(self) -> PlanningGraph:
+        return _load_graph(self._data)
+
+    def _label(self, index: int) -> PropositionLabel:
+        return bytes(self._label_blob[self._label_offsets[index]:self._label_offsets[index + 1]]).decode('utf-8')
+
+    def _proposition_index(self, proposition: PropositionLabel) -> typing.Optional[int]:
+        if self._proposition_indexes is None:
+            self._proposition_indexes = {
+                self._label(index): index
+                for index in range(self._proposition_counts[self.depth])
+            }
+
+        return self._proposition_indexes.get(proposition)
+
+    def propositions_at(self, level: int) -> typing.List[PropositionLabel]:
+        return [self._label(index) for index in range(self._proposition_counts[level])]
+
+    def proposition_level(self, proposition: PropositionLabel) -> typing.Optional[int]:
+        index = self._proposition_index(proposition)
+        if index is None:
+            return None
+
+        return bisect.bisect_right(self._proposition_counts, index)
+
+    def is_propositions_mutex(self, proposition_a: PropositionLabel, proposition_b: PropositionLabel, level: int):
+        index_a = self._proposition_index(proposition_a)
+        index_b = self._proposition_index(proposition_b)
+
+        if index_a is None or index_b is None:
+            return False
+
+        key = (min(index_a, index_b), max(index_a, index_b))
+        spans = self._proposition_spans
+
+        low, high = 0, len(spans) // 4
+        while low < high:
+            middle = (low + high) // 2
+            if (spans[4 * middle], spans[4 * middle + 1]) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        while low < len(spans) // 4 and (spans[4 * low], spans[4 * low + 1]) == key:
+            if spans[4 * low + 2] <= level <= spans[4 * low + 3]:
+                return True
+            low += 1
+
+        return False
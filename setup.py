@@ -16,6 +16,11 @@ setup(
         'attrs',
     ],
 
+    extras_require={
+        'numpy': ['numpy'],
+        'toml': ['tomli; python_version < "3.11"'],
+    },
+
     tests_require=[
         'pytest',
     ]
@@ -0,0 +1,11 @@
+from graph_plan import planner
+
+
+def build_action(name, **kwargs):
+    action_template = planner.Action(
+        name=name,
+        requirements=set(),
+        effects=set(),
+    )
+
+    return action_template.copy(**kwargs)
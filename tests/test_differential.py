@@ -0,0 +1,91 @@
+import json
+import random
+
+from graph_plan import differential
+from graph_plan import profiling
+from graph_plan.__main__ import main
+
+from helpers import build_action
+
+
+def test_random_problem_is_seeded():
+    assert differential.random_problem(random.Random(7)) == differential.random_problem(random.Random(7))
+
+
+def test_validate_plan():
+    add_x = build_action('add_x', effects={'x'})
+    add_y = build_action('add_y', requirements={'x'}, effects={'y'})
+    problem = differential.Problem(state=set(), goal={'y'}, actions={add_x, add_y})
+
+    assert differential.validate_plan(problem, [add_x, add_y])
+    assert not differential.validate_plan(problem, [add_y])
+    assert not differential.validate_plan(problem, [add_x])
+
+
+def test_engines_report_depth():
+    add_x = build_action('add_x', effects={'x'})
+    add_y = build_action('add_y', requirements={'x'}, effects={'y'})
+    problem = differential.Problem(state=set(), goal={'y'}, actions={add_x, add_y})
+
+    for name, engine in differential.ENGINES.items():
+        assert engine(problem) == differential.Result(plan=[add_x, add_y], depth=2), name
+
+
+def test_engines_agree_with_reference():
+    assert differential.run(iterations=100, seed=0) == []
+
+
+def test_mismatch_is_shrunk():
+    def broken_engine(problem):
+        # forgets every action that has requirements
+        actions = {action for action in problem.actions if not action.requirements}
+        return differential.reference_engine(differential.Problem(problem.state, problem.goal, actions))
+
+    mismatches = differential.run(iterations=50, seed=0, engines={'broken': broken_engine})
+
+    assert len(mismatches) == 1
+    mismatch = mismatches[0]
+
+    assert mismatch.engine == 'broken'
+    assert mismatch.reason == 'no plan'
+    # only what is needed to reach one goal through an action with
+    # requirements survives shrinking
+    assert len(mismatch.problem.goal) == 1
+    assert [action for action in mismatch.problem.actions if action.requirements]
+
+
+def test_profile_domain(tmp_path):
+    source_path = tmp_path / 'domain.json'
+    source_path.write_text(json.dumps({
+        'actions': [
+            {'name': 'add_x', 'effects': ['x']},
+            {'name': 'add_y', 'requirements': ['x'], 'effects': ['y']},
+        ],
+    }))
+
+    profiler, plan = profiling.profile_domain(str(source_path), set(), {'y'})
+
+    assert [action.name for action in plan] == ['add_x', 'add_y']
+    assert set(profiler.phases) == {'load', 'build', 'search'}
+    assert profiler.phases['build'].calls == 2
+    assert profiler.phases['build'].allocated_blocks > 0
+
+    report = profiler.report(top=5)
+    assert '== search:' in report
+    assert 'calculate_next_layer' in report
+
+
+def test_profile_command(tmp_path, capsys):
+    source_path = tmp_path / 'domain.json'
+    source_path.write_text(json.dumps({'actions': [{'name': 'add_x', 'effects': ['x']}]}))
+
+    main(['profile', str(source_path), '--goal', 'x', '--no-allocations'])
+
+    output = capsys.readouterr().out
+    assert "plan: ['add_x']" in output
+    assert 'allocated' not in output
+
+
+def test_check_command(capsys):
+    assert main(['check', '--iterations', '20', '--seed', '1']) == 0
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from graph_plan import _binary
+from graph_plan import domain
+from graph_plan import planner
+
+
+DESCRIPTION = {
+    'actions': [
+        {
+            'name': 'set_downtime',
+            'effects': ['downtime'],
+        },
+        {
+            'name': 'remove_downtime',
+            'requirements': ['downtime'],
+            'deletes': ['downtime'],
+        },
+    ],
+    'templates': [
+        {
+            'name': 'reserve_{iface}',
+            'effects': ['{iface}'],
+            'parameters': {'iface': ['ip_address', 'ip_address_ipmi']},
+        },
+    ],
+}
+
+
+def test_domain_from_dict():
+    _domain = domain.Domain.from_dict(DESCRIPTION)
+
+    assert {action.name for action in _domain.actions} == {
+        'set_downtime', 'remove_downtime', 'reserve_ip_address', 'reserve_ip_address_ipmi',
+    }
+
+    remove_downtime = next(action for action in _domain.actions if action.name == 'remove_downtime')
+    set_downtime = next(action for action in _domain.actions if action.name == 'set_downtime')
+
+    assert remove_downtime.effects == {'downtime__unset'}
+    assert set_downtime.effects == {'downtime'}
+    assert set(_domain.labels) == {
+        'downtime', 'downtime__unset', 'ip_address', 'ip_address__unset',
+        'ip_address_ipmi', 'ip_address_ipmi__unset',
+    }
+
+
+def test_domain_from_dict_invalid():
+    with pytest.raises(domain.DomainFormatError):
+        domain.Domain.from_dict({'actions': [{'effects': ['x']}]})
+
+
+def test_domain_bytes_round_trip():
+    _domain = domain.Domain.from_dict(DESCRIPTION, fingerprint=b'\1' * 32)
+
+    assert domain.Domain.from_bytes(_domain.to_bytes()) == _domain
+
+
+def test_domain_from_bytes_invalid():
+    with pytest.raises(domain.DomainFormatError):
+        domain.Domain.from_bytes(b'not a domain')
+
+
+def test_load_domain_uses_compiled_cache(tmp_path):
+    source_path = tmp_path / 'domain.json'
+    source_path.write_text(json.dumps(DESCRIPTION))
+
+    _domain = domain.load_domain(str(source_path))
+    cache_path = tmp_path / 'domain.json.gpd'
+
+    assert cache_path.exists()
+    assert domain.load_compiled_domain(str(cache_path)) == _domain
+    assert domain.load_domain(str(source_path)) == _domain
+
+    source_path.write_text(json.dumps({'actions': DESCRIPTION['actions']}))
+
+    assert len(domain.load_domain(str(source_path)).actions) == 2
+
+
+def test_load_domain_toml(tmp_path):
+    source_path = tmp_path / 'domain.toml'
+    source_path.write_text(
+        '[[actions]]\n'
+        'name = "add_x"\n'
+        'effects = ["x"]\n'
+    )
+
+    _domain = domain.read_domain(str(source_path))
+
+    assert planner.Planner().plan(set(), {'x'}, set(_domain.actions)) == list(_domain.actions)
+
+
+def test_load_domain_without_writable_cache(tmp_path):
+    source_path = tmp_path / 'domain.json'
+    source_path.write_text(json.dumps(DESCRIPTION))
+    cache_path = tmp_path / 'missing' / 'domain.gpd'
+
+    _domain = domain.load_domain(str(source_path), cache_path=str(cache_path))
+
+    assert len(_domain.actions) == 4
+    assert not (tmp_path / 'missing').exists()
+
+
+def test_load_domain_rebuilds_corrupted_cache(tmp_path):
+    source_path = tmp_path / 'domain.json'
+    source_path.write_text(json.dumps(DESCRIPTION))
+    cache_path = tmp_path / 'domain.json.gpd'
+
+    _domain = domain.load_domain(str(source_path))
+
+    # point the first requirement at a label that does not exist
+    data = bytearray(cache_path.read_bytes())
+    reader = _binary.Reader(memoryview(data), domain._HEADER.size)
+    reader.strings()
+    reader.strings()
+    reader.array('I')
+    offset = reader.offset + _binary.COUNT.size
+    data[offset:offset + 4] = (2 ** 31).to_bytes(4, 'little')
+    cache_path.write_bytes(bytes(data))
+
+    assert domain.load_domain(str(source_path)) == _domain
+    assert domain.load_compiled_domain(str(cache_path)) == _domain
+
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+import pytest
+
+from graph_plan import executor
+from graph_plan import planner
+
+from helpers import build_action
+
+
+ADD_X = build_action('add_x', effects={'x'})
+ADD_Y = build_action('add_y', effects={'y'})
+ADD_Z = build_action('add_z', requirements={'x'}, effects={'z'})
+
+
+def build_plan():
+    return planner.Planner().plan_layered(
+        state=set(),
+        goal={'y', 'z'},
+        actions={ADD_X, ADD_Y, ADD_Z},
+    )
+
+
+def test_execute_runs_independent_steps_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    handlers = {
+        'add_x': lambda action: barrier.wait(),
+        'add_y': lambda action: barrier.wait(),
+        'add_z': lambda action: None,
+    }
+
+    report = executor.PlanExecutor(handlers, max_workers=2).execute(build_plan())
+
+    assert report.ok
+    assert report.propositions == {'x', 'y', 'z'}
+    assert all(result.duration is not None for result in report.results.values())
+
+
+def test_execute_skips_dependents_of_failed_step():
+    def fail(action):
+        raise RuntimeError('boom')
+
+    handlers = {
+        'add_x': fail,
+        'add_y': lambda action: None,
+        'add_z': lambda action: None,
+    }
+
+    report = executor.PlanExecutor(handlers).execute(build_plan())
+
+    assert not report.ok
+    assert [result.plan_step.action for result in report.failed] == [ADD_X]
+    assert [result.plan_step.action for result in report.skipped] == [ADD_Z]
+    assert [result.plan_step.action for result in report.succeeded] == [ADD_Y]
+    assert report.propositions == {'y'}
+
+
+def test_execute_missing_handler():
+    with pytest.raises(ValueError):
+        executor.PlanExecutor({}).execute(build_plan())
+
+
+def test_execute_async():
+    executed = []
+
+    async def handler(action):
+        executed.append(action)
+
+    handlers = {
+        'add_x': handler,
+        'add_y': handler,
+        'add_z': lambda action: executed.append(action),
+    }
+
+    report = asyncio.run(executor.PlanExecutor(handlers).execute_async(build_plan()))
+
+    assert report.ok
+    assert executed.index(ADD_X) < executed.index(ADD_Z)
@@ -0,0 +1,126 @@
+import pytest
+
+from graph_plan import fleet
+from graph_plan import planner
+
+from helpers import build_action
+
+
+ADD_X = build_action('add_x', effects={'x'})
+ADD_Y = build_action('add_y', requirements={'x'}, effects={'y'})
+
+ACTIONS = {ADD_X, ADD_Y}
+
+WORLDS = [
+    {'x': 'set', 'y': '', 'other': 1},
+    {'x': '', 'y': ''},
+    {'x': 'set', 'y': ''},
+    {'y': 'set'},
+]
+
+
+def test_states_from_worlds():
+    index = planner.PropositionIndex(['x', 'y', 'x__unset'])
+
+    states = fleet.states_from_worlds(WORLDS, index)
+
+    assert [index.propositions(state) for state in states] == [
+        {'x'}, {'x__unset'}, {'x'}, {'y'},
+    ]
+
+
+def test_states_from_worlds_columns():
+    index = planner.PropositionIndex(['x', 'y', 'x__unset'])
+
+    columns = {
+        'x': ['set', '', 'set', None],
+        'y': ['', '', '', 'set'],
+    }
+
+    assert fleet.states_from_worlds(columns, index) == fleet.states_from_worlds(
+        [{'x': 'set', 'y': ''}, {'x': '', 'y': ''}, {'x': 'set', 'y': ''}, {'x': None, 'y': 'set'}],
+        index,
+    )
+
+
+def test_states_matrix():
+    numpy = pytest.importorskip('numpy')
+    index = planner.PropositionIndex(['x', 'x__unset'])
+
+    matrix = fleet.states_matrix(WORLDS, index)
+
+    assert matrix.tolist() == [[True, False], [False, True], [True, False], [False, False]]
+    assert matrix.dtype == numpy.bool_
+
+
+def test_group_states():
+    assert fleet.group_states([1, 2, 1, 4]) == {1: [0, 2], 2: [1], 4: [3]}
+
+
+def test_plan_worlds():
+    plans = fleet.plan_worlds(WORLDS, {'y'}, ACTIONS)
+
+    assert plans == [[ADD_Y], [ADD_X, ADD_Y], [ADD_Y], []]
+    assert plans[0] is not plans[2]
+
+    plans[0].append(ADD_X)
+    assert plans[2] == [ADD_Y]
+
+
+def test_plan_worlds_goal_outside_actions():
+    _planner = planner.Planner()
+
+    assert fleet.plan_worlds(WORLDS, {'other'}, ACTIONS, _planner) == [[], None, None, None]
+    assert fleet.plan_worlds(WORLDS, {'y__unset'}, ACTIONS, _planner) == [[], [], [], None]
+
+    # goal labels do not leak into the shared dependency index
+    assert 'other' not in _planner.dependency_index(ACTIONS).propositions
+
+
+def build_host(name, state):
+    add_x = build_action(f'add_x[{name}]', effects={f'{name}.x'})
+    add_y = build_action(f'add_y[{name}]', requirements={f'{name}.x'}, effects={f'{name}.y'})
+
+    return fleet.Subproblem(
+        name=name,
+        state=state,
+        goal={f'{name}.y'},
+        actions={add_x, add_y},
+    )
+
+
+def test_subproblem_signature():
+    assert build_host('host1', set()).signature() == build_host('host2', set()).signature()
+    assert build_host('host1', set()).signature() != build_host('host2', {'host2.x'}).signature()
+
+
+def test_plan_subproblems():
+    hosts = [build_host(f'host{index}', set()) for index in range(10)]
+    hosts.append(build_host('other', {'other.x'}))
+
+    _planner = planner.Planner()
+    searches = []
+    plan = _planner.plan
+
+    def counting_plan(*args, **kwargs):
+        searches.append(args)
+        return plan(*args, **kwargs)
+
+    _planner.plan = counting_plan
+
+    plans = fleet.plan_subproblems(hosts, _planner)
+
+    assert len(searches) == 2
+    assert [action.name for action in plans['host7']] == ['add_x[host7]', 'add_y[host7]']
+    assert [action.name for action in plans['other']] == ['add_y[other]']
+
+
+def test_plan_subproblems_goal_outside_actions():
+    def build_checked_host(name, state):
+        return fleet.Subproblem(name=name, state=state, goal={f'{name}.ok'}, actions=build_host(name, set()).actions)
+
+    assert build_checked_host('h1', {'h1.ok'}).signature() != build_checked_host('h2', set()).signature()
+
+    plans = fleet.plan_subproblems([build_checked_host('h1', {'h1.ok'}), build_checked_host('h2', set())])
+
+    assert plans == {'h1': [], 'h2': None}
@@ -1,3 +1,9 @@
+import collections
+import concurrent.futures
+import gc
+import itertools
+import logging
+
 import pytest
 
 from graph_plan import planner
@@ -5,6 +11,8 @@ from graph_plan import planner
 # from graph_plan.planner import GraphBuilder, GraphSolver
 # from graph_plan.planner import PlanNotFound, PlanNotPossible
 
+from helpers import build_action
+
 
 def build_layer(**kwargs):
     empty_layer = planner.Layer(
@@ -19,16 +27,6 @@ def build_layer(**kwargs):
     )
 
 
-def build_action(name, **kwargs):
-    action_template = planner.Action(
-        name=name,
-        requirements=set(),
-        effects=set(),
-    )
-
-    return action_template.copy(**kwargs)
-
-
 def test_graph_layer_build_empty():
     builder = planner.GraphBuilder()
 
@@ -103,6 +101,60 @@ def test_graph_layer_actions_noop():
     assert next_layer.actions == [noop_action]
 
 
+def test_action_noop_is_canonical():
+    noop_action = planner.Action.noop_action('x')
+
+    assert planner.Action.noop_action('x') is noop_action
+    assert noop_action.requirements is noop_action.effects
+    assert noop_action == planner.Action(
+        name='noop_x',
+        requirements={'x'},
+        effects={'x'},
+    )
+
+
+def test_action_noop_cache_does_not_keep_labels():
+    planner.Action.noop_action('label_seen_once')
+    gc.collect()
+
+    assert 'label_seen_once' not in planner._noop_actions
+
+
+def test_action_copies_set_views():
+    requirements = {'x': 1}
+    action = planner.Action(name='action', requirements=requirements.keys(), effects={'y'})
+
+    requirements['z'] = 2
+
+    assert action.requirements == frozenset({'x'})
+    assert type(action.requirements) is frozenset
+
+
+def test_action_deletes():
+    action = build_action('action', effects={'x', 'y_z__unset'})
+
+    assert action.effects == frozenset({'x', 'y_z__unset'})
+    assert action.deletes == frozenset({'x__unset', 'y_z'})
+
+
+def test_graph_layer_shares_unchanged_structures():
+    builder = planner.GraphBuilder()
+
+    action = build_action('action', effects={'x'})
+
+    first_layer = builder.calculate_next_layer(
+        current_state=build_layer(),
+        available_actions=[action],
+    )
+    next_layer = builder.calculate_next_layer(
+        current_state=first_layer,
+        available_actions=[action],
+    )
+
+    assert next_layer.propositions is first_layer.propositions
+    assert next_layer.mutex_propositions is first_layer.mutex_propositions
+
+
 @pytest.mark.parametrize(
     'action_a_kwargs, action_b_kwargs, state_kwargs', [
         ({'effects': {'x'}}, {'effects': {'x__unset'}}, {}),
@@ -261,7 +313,7 @@ def test_update_world():
     actions = {add_x, add_y, add_z}
 
     expected_plan = [
-        add_x, add_y
+        add_x, add_y, add_z
     ]
 
     _planner = planner.Planner()
@@ -304,3 +356,202 @@ def test_plan_simple():
         add_x,
         add_y,
     ]
+
+
+def test_planning_graph_levels():
+    builder = planner.GraphBuilder()
+
+    add_x = build_action(name='add_x', effects={'x', 'y__unset'})
+    add_y = build_action(name='add_y', requirements={'x'}, effects={'y'})
+
+    graph = planner.PlanningGraph({'y__unset'})
+    layer = graph.layer(0)
+
+    for _ in range(3):
+        layer = builder.calculate_next_layer(layer, [add_x, add_y])
+        graph.add_layer(layer)
+
+    assert graph.depth == 3
+    assert graph.propositions_at(0) == {'y__unset'}
+    assert graph.propositions_at(1) == {'x', 'y__unset'}
+    assert graph.propositions_at(2) == {'x', 'y', 'y__unset'}
+    assert graph.proposition_level('y') == 2
+    assert graph.action_level(add_y) == 2
+    assert add_y not in graph.actions_at(1)
+    assert set(graph.actions_at(3)) == set(layer.actions)
+    assert graph.layer(3).mutex_propositions == layer.mutex_propositions
+
+    assert graph.is_propositions_mutex('y', 'y__unset', 2)
+    assert graph.is_propositions_mutex('y', 'y__unset', 3)
+    assert not graph.is_propositions_mutex('x', 'y', 0)
+
+
+def test_plan_layered():
+    add_x = build_action(name='add_x', effects={'x'})
+    add_y = build_action(name='add_y', effects={'y'})
+    add_z = build_action(name='add_z', requirements={'x'}, effects={'z'})
+    remove_y = build_action(name='remove_y', requirements={'z'}, effects={'y__unset'})
+
+    _planner = planner.Planner()
+
+    plan = _planner.plan_layered(
+        state=set(),
+        goal={'z', 'y'},
+        actions={add_x, add_y, add_z, remove_y},
+    )
+
+    assert plan.steps == [{add_x, add_y}, {add_z}]
+    assert plan.dependencies == {
+        planner.PlanStep(0, add_x): set(),
+        planner.PlanStep(0, add_y): set(),
+        planner.PlanStep(1, add_z): {planner.PlanStep(0, add_x)},
+    }
+    assert set(plan.actions) == {add_x, add_y, add_z}
+
+
+def test_dependency_index():
+    add_x = build_action(name='add_x', effects={'x'})
+    add_y = build_action(name='add_y', requirements={'x'}, effects={'y'})
+    add_z = build_action(name='add_z', requirements={'y', 'w'}, effects={'z'})
+    add_x_from_z = build_action(name='add_x_from_z', requirements={'z'}, effects={'x'})
+
+    index = planner.DependencyIndex([add_x, add_y, add_z, add_x_from_z])
+
+    assert index.dependents('x') == {'x', 'y', 'z'}
+    assert index.dependents('w') == {'x', 'y', 'z'}
+    assert index.dependents('z') == {'x', 'y', 'z'}
+    assert index.invalidated({'y', 'unknown'}) == {'x', 'y', 'z', 'unknown'}
+    assert index.relevant_state({'x', 'w', 'unknown'}) == {'x', 'w'}
+    assert 'unknown' not in index.relevant
+
+
+def test_planner_caches_are_bounded():
+    action_sets = [{build_action(name=f'add_{index}', effects={f'p{index}'})} for index in range(5)]
+
+    _planner = planner.Planner(cache_size=2)
+    for index, actions in enumerate(action_sets):
+        _planner.plan(set(), {f'p{index}'}, actions, graph=planner.PlanningGraph(set()))
+        _planner.dependency_index(actions)
+
+    assert len(_planner._dependency_indexes) == 2
+    assert len(_planner._actions_fingerprints) == 2
+    assert _planner.actions_fingerprint(action_sets[0]) == planner.actions_fingerprint(action_sets[0])
+    assert _planner.dependency_index(action_sets[-1]) is _planner.dependency_index(action_sets[-1])
+
+
+def test_plan_concurrent():
+    actions = {
+        build_action(name='add_x', effects={'x'}),
+        build_action(name='add_y', requirements={'x'}, effects={'y'}),
+        build_action(name='replace_x_z', requirements={'x'}, effects={'z', 'x__unset'}),
+        build_action(name='add_w', requirements={'z'}, effects={'w'}),
+    }
+    states = [
+        set(state)
+        for size in range(3)
+        for state in itertools.combinations(['x', 'y', 'z', 'x__unset'], size)
+    ]
+
+    _planner = planner.Planner()
+
+    def plan(state):
+        try:
+            return (
+                _planner.plan(state, {'y', 'w'}, actions),
+                _planner.plan_state_update(state | {'y'}, {'x'}, actions),
+            )
+
+        except planner.PlanNotPossible:
+            return None
+
+    expected = [plan(state) for state in states]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        for _ in range(10):
+            assert list(pool.map(plan, states)) == expected
+
+
+def test_plan_lazy_mutex(caplog):
+    actions = {
+        build_action(name='add_x', effects={'x'}),
+        build_action(name='add_y', requirements={'x'}, effects={'y'}),
+        build_action(name='replace_x_z', requirements={'x'}, effects={'z', 'x__unset'}),
+    } | {
+        build_action(name=f'add_unrelated_{index}', effects={f'unrelated_{index}'})
+        for index in range(10)
+    }
+
+    graph = planner.PlanningGraph(set())
+
+    computed = collections.Counter()
+    compute = graph._compute_propositions_mutex
+
+    def counting_compute(proposition_a, proposition_b, level):
+        computed[level] += 1
+        return compute(proposition_a, proposition_b, level)
+
+    graph._compute_propositions_mutex = counting_compute
+
+    # logging layers must not compute the remaining pairs
+    with caplog.at_level(logging.INFO, logger='graph_plan.planner'):
+        plan = planner.Planner(lazy_mutex=True).plan(set(), {'x', 'y', 'z'}, actions, graph=graph)
+
+    assert plan == planner.Planner().plan(set(), {'x', 'y', 'z'}, actions)
+    assert '"lazy": true' in repr(graph.layer(graph.depth))
+
+    # an eager graph checks every pair on every level, a lazy one checks
+    # a pair again only on levels its record does not cover
+    pairs = {
+        level: len(graph.propositions_at(level)) * (len(graph.propositions_at(level)) - 1) // 2
+        for level in range(graph.depth + 1)
+    }
+    assert sum(computed.values()) < sum(pairs.values()) / 2
+    assert computed[1] == 0
+    assert computed[graph.depth - 1] < pairs[graph.depth - 1] / 10
+
+    eager_graph = planner.PlanningGraph(set())
+    planner.Planner().plan(set(), {'x', 'y', 'z'}, actions, graph=eager_graph)
+    for level in range(graph.depth + 1):
+        assert graph.layer(level).mutex_actions == eager_graph.layer(level).mutex_actions
+        assert graph.layer(level).mutex_propositions == eager_graph.layer(level).mutex_propositions
+
+    # one record per pair of propositions serves every level
+    propositions = len(graph.propositions_at(graph.depth))
+    assert len(graph._lazy_pairs) <= propositions * (propositions - 1) // 2
+
+    graph.materialize_mutex()
+    for level in range(graph.depth + 1):
+        assert graph.layer(level) == eager_graph.layer(level)
+
+
+def test_iter_plans():
+    add_x = build_action(name='add_x', effects={'x'})
+    add_x_slowly = build_action(name='add_x_slowly', requirements={'w'}, effects={'x'})
+    add_w = build_action(name='add_w', effects={'w'})
+    add_y = build_action(name='add_y', requirements={'x'}, effects={'y'})
+
+    _planner = planner.Planner()
+    actions = {add_x, add_x_slowly, add_w, add_y}
+
+    plans = list(_planner.iter_plans(set(), {'y'}, actions))
+
+    assert plans[0] == [add_x, add_y]
+    assert plans[0] == _planner.plan(set(), {'y'}, actions)
+    assert [add_w, add_x_slowly, add_y] in plans
+    assert len(plans) == len(set(map(tuple, plans)))
+    assert all(len(plans[0]) <= len(plan) for plan in plans)
+
+
+def test_iter_plans_stop_early():
+    add_x = build_action(name='add_x', effects={'x'})
+
+    plans = planner.Planner().iter_plans(set(), {'x'}, {add_x})
+
+    assert next(plans) == [add_x]
+    plans.close()
+
+
+def test_iter_plans_not_possible():
+    add_x = build_action(name='add_x', effects={'x'})
+
+    assert list(planner.Planner().iter_plans(set(), {'y'}, {add_x})) == []
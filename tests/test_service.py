@@ -0,0 +1,160 @@
+import http.client
+import io
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from graph_plan import domain
+from graph_plan import service
+
+
+DESCRIPTION = {
+    'actions': [
+        {'name': 'add_x', 'effects': ['x']},
+        {'name': 'add_y', 'requirements': ['x'], 'effects': ['y']},
+        {'name': 'add_z', 'effects': ['z']},
+    ],
+}
+
+
+@pytest.fixture
+def planning_service():
+    return service.PlanningService(domain.Domain.from_dict(DESCRIPTION))
+
+
+def test_handle(planning_service):
+    response = planning_service.handle({'id': 1, 'state': [], 'goal': ['y', 'z'], 'layered': True})
+
+    assert response['id'] == 1
+    assert response['steps'] == [['add_x', 'add_z'], ['add_y']]
+    assert sorted(response['plan']) == ['add_x', 'add_y', 'add_z']
+
+
+def test_handle_cache(planning_service):
+    first = planning_service.handle({'id': 1, 'world': {'x': True}, 'goal': ['y']})
+    second = planning_service.handle({'id': 2, 'world': {'x': True}, 'goal': ['y']})
+
+    assert first['plan'] == second['plan'] == ['add_y']
+    assert second['id'] == 2
+
+    metrics = planning_service.metrics.describe()
+    assert metrics['counters']['searches'] == 1
+    assert metrics['cache_hit_rate'] == 0.5
+    assert metrics['latency_ms']['count'] == 2
+
+
+def test_handle_errors(planning_service):
+    assert planning_service.handle({'id': 1, 'state': []})['error']
+    assert planning_service.handle({'id': 2, 'state': [], 'goal': ['w']})['error'] == 'plan not possible'
+    assert planning_service.handle_line('not json')['error']
+
+    for request in (
+            {'id': 3, 'world': [1], 'goal': ['y']},
+            {'id': 4, 'state': 'x', 'goal': ['y']},
+            {'id': 5, 'state': [], 'goal': [1]},
+            {'id': 6, 'state': [], 'update': None},
+            {'id': 7, 'state': [], 'goal': ['y'], 'layered': 'no'},
+    ):
+        assert 'must be' in planning_service.handle(request)['error']
+
+    assert planning_service.metrics.describe()['counters']['errors'] == 7
+
+
+@pytest.mark.parametrize('error', [RuntimeError('broken'), TypeError('broken')])
+def test_handle_unexpected_error(planning_service, monkeypatch, caplog, error):
+    def broken_plan(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(planning_service.planner, 'plan_layered', broken_plan)
+
+    response = planning_service.handle({'id': 1, 'state': [], 'goal': ['y']})
+
+    assert response['id'] == 1
+    assert response['error'].startswith('internal error') and 'broken' in response['error']
+    assert planning_service.metrics.describe()['counters']['errors'] == 1
+    assert 'Failed to handle request 1' in caplog.text
+
+
+def test_handle_caches_plan_not_possible(planning_service):
+    for index in range(3):
+        response = planning_service.handle({'id': index, 'state': [], 'goal': ['w']})
+        assert response['error'] == 'plan not possible'
+
+    counters = planning_service.metrics.describe()['counters']
+    assert counters['searches'] == 1
+    assert counters['plans_not_possible'] == 3
+
+
+def test_handle_update(planning_service):
+    response = planning_service.handle({'id': 1, 'state': ['x', 'y'], 'update': ['x']})
+
+    assert response['plan'] == ['add_x', 'add_y']
+
+
+def test_run_batch(planning_service):
+    requests = [
+        {'id': index, 'state': [], 'goal': ['y']}
+        for index in range(20)
+    ]
+    output = io.StringIO()
+
+    service.run_batch(
+        planning_service,
+        io.StringIO('\n'.join(json.dumps(request) for request in requests) + '\n'),
+        output,
+        max_workers=4,
+    )
+
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [response['id'] for response in responses] == list(range(20))
+    assert all(response['plan'] == ['add_x', 'add_y'] for response in responses)
+
+
+def test_run_batch_keeps_going_after_bad_requests(planning_service):
+    output = io.StringIO()
+
+    service.run_batch(
+        planning_service,
+        io.StringIO('{"id": 1, "world": [1], "goal": ["y"]}\n{"id": 2, "state": [], "goal": ["y"]}\n'),
+        output,
+    )
+
+    first, second = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert first['error']
+    assert second['plan'] == ['add_x', 'add_y']
+
+
+def test_http_server(planning_service):
+    server = service.make_http_server(planning_service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = 'http://{}:{}'.format(*server.server_address[:2])
+
+    try:
+        request = urllib.request.Request(
+            f'{url}/plan',
+            data=json.dumps({'id': 'a', 'state': [], 'goal': ['x']}).encode('utf-8'),
+            method='POST',
+        )
+        with urllib.request.urlopen(request) as response:
+            assert json.loads(response.read()) == {'id': 'a', 'plan': ['add_x']}
+
+        with urllib.request.urlopen(f'{url}/metrics') as response:
+            assert json.loads(response.read())['counters']['requests'] == 1
+
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+        connection.putrequest('POST', '/plan')
+        connection.putheader('Content-Length', 'many')
+        connection.endheaders()
+        response = connection.getresponse()
+
+        assert response.status == 400
+        assert json.loads(response.read())['error'] == 'invalid Content-Length'
+        connection.close()
+
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from graph_plan import planner
+from graph_plan import session
+
+from helpers import build_action
+
+
+ADD_X = build_action('add_x', effects={'x'})
+ADD_Y = build_action('add_y', requirements={'x'}, effects={'y'})
+ADD_A = build_action('add_a', effects={'a'})
+ADD_B = build_action('add_b', requirements={'a'}, effects={'b'})
+
+ACTIONS = {ADD_X, ADD_Y, ADD_A, ADD_B}
+
+
+def test_session_update():
+    _session = session.PlanSession({'x', 'y', 'a', 'b'}, ACTIONS)
+
+    assert _session.update({'x'}) == [ADD_X, ADD_Y]
+    assert _session.state == {'a', 'b'}
+
+
+def test_session_update_keeps_valid_prefix():
+    _session = session.PlanSession({'x', 'y', 'a', 'b'}, ACTIONS)
+    _session.update({'x'})
+
+    plan = _session.update({'a'})
+
+    assert plan[:2] == [ADD_X, ADD_Y]
+    assert sorted(action.name for action in plan[2:]) == ['add_a', 'add_b']
+
+
+def test_session_update_nothing_new():
+    _session = session.PlanSession({'x', 'y', 'a', 'b'}, ACTIONS)
+    plan = _session.update({'x'})
+
+    assert _session.update({'x'}) == plan
+
+
+def test_session_complete():
+    _session = session.PlanSession({'x', 'y', 'a', 'b'}, ACTIONS)
+    _session.update({'x'})
+
+    _session.complete(ADD_X)
+
+    assert _session.plan == [ADD_Y]
+    assert 'x' in _session.state
+
+
+def test_session_astream():
+    _session = session.PlanSession({'x', 'y', 'a', 'b'}, ACTIONS)
+
+    async def updates():
+        yield {'x'}
+        yield {'x'}
+
+    async def collect():
+        return [plan async for plan in _session.astream(updates())]
+
+    assert asyncio.run(collect()) == [[ADD_X, ADD_Y], [ADD_X, ADD_Y]]
+
+
+def test_session_update_not_possible():
+    _session = session.PlanSession({'x', 'y'}, {ADD_Y})
+
+    for _ in range(2):
+        with pytest.raises(planner.PlanNotPossible):
+            _session.update({'x'})
+
+        assert _session.state == {'x', 'y'}
+        assert _session.plan == []
+
+
+def test_session_stream_not_possible():
+    _session = session.PlanSession({'x', 'y', 'a', 'b'}, {ADD_Y, ADD_A, ADD_B})
+
+    assert list(_session.stream([{'x'}, {'a'}])) == [None, [ADD_A, ADD_B]]
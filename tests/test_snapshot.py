@@ -0,0 +1,113 @@
+import pytest
+
+from graph_plan import planner
+from graph_plan import snapshot
+
+from helpers import build_action
+
+
+ADD_X = build_action('add_x', effects={'x'})
+ADD_Y = build_action('add_y', requirements={'x'}, effects={'y'})
+REPLACE_X_Z = build_action('replace_x_z', requirements={'x'}, effects={'z', 'x__unset'})
+
+ACTIONS = {ADD_X, ADD_Y, REPLACE_X_Z}
+
+
+def build_graph():
+    graph = planner.PlanningGraph(set())
+    planner.Planner().plan(set(), {'x', 'y', 'z'}, ACTIONS, graph=graph)
+    return graph
+
+
+def test_snapshot_round_trip():
+    graph = build_graph()
+
+    loaded = snapshot.load_graph(snapshot.dump_graph(graph))
+
+    assert loaded.depth == graph.depth
+    assert loaded.nogoods == graph.nogoods
+    for level in range(graph.depth + 1):
+        assert loaded.layer(level) == graph.layer(level)
+
+    assert planner.Planner().plan(set(), {'x', 'y', 'z'}, ACTIONS, graph=loaded) == \
+        planner.Planner().plan(set(), {'x', 'y', 'z'}, ACTIONS)
+
+
+def test_snapshot_reader(tmp_path):
+    graph = build_graph()
+    path = str(tmp_path / 'graph.gpg')
+    snapshot.write_snapshot(graph, path)
+
+    with snapshot.SnapshotReader(path) as reader:
+        assert reader.depth == graph.depth
+        assert set(reader.propositions_at(1)) == graph.propositions_at(1)
+        assert reader.proposition_level('y') == graph.proposition_level('y')
+        assert reader.proposition_level('unknown') is None
+
+        for level in range(graph.depth + 1):
+            assert reader.is_propositions_mutex('z', 'x', level) == graph.is_propositions_mutex('z', 'x', level)
+            assert reader.is_propositions_mutex('y', 'x', level) == graph.is_propositions_mutex('y', 'x', level)
+
+        assert reader.load().layer(graph.depth) == graph.layer(graph.depth)
+
+
+def test_snapshot_invalid():
+    with pytest.raises(snapshot.SnapshotFormatError):
+        snapshot.load_graph(b'GPGRAPH\0')
+
+
+def test_plan_with_graph_for_other_state():
+    with pytest.raises(ValueError):
+        planner.Planner().plan({'x'}, {'y'}, ACTIONS, graph=build_graph())
+
+
+def test_plan_with_graph_for_other_actions():
+    graph = snapshot.load_graph(snapshot.dump_graph(build_graph()))
+
+    assert graph.actions_fingerprint == planner.actions_fingerprint(ACTIONS)
+
+    with pytest.raises(ValueError):
+        planner.Planner().plan(set(), {'y'}, {ADD_X, ADD_Y}, graph=graph)
+
+
+def test_plan_with_graph_after_unsolvable_goal():
+    graph = planner.PlanningGraph(set())
+
+    with pytest.raises(planner.PlanNotPossible):
+        planner.Planner().plan(set(), {'w'}, ACTIONS, graph=graph)
+
+    loaded = snapshot.load_graph(snapshot.dump_graph(graph))
+
+    for warm_graph in (graph, loaded):
+        assert planner.Planner().plan(set(), {'x'}, ACTIONS, graph=warm_graph) == [ADD_X]
+        assert planner.Planner().plan(set(), {'y'}, ACTIONS, graph=warm_graph) == [ADD_X, ADD_Y]
+
+
+def test_dump_lazy_graph():
+    graph = planner.PlanningGraph(set())
+    planner.Planner(lazy_mutex=True).plan(set(), {'x', 'y', 'z'}, ACTIONS, graph=graph)
+    lazy_layers = graph.layers()
+    lazy_levels = set(graph._lazy_levels)
+
+    loaded = snapshot.load_graph(snapshot.dump_graph(graph))
+
+    # dumping leaves the graph lazy
+    assert lazy_levels and graph._lazy_levels == lazy_levels
+    assert graph._mutex_propositions == {} and graph._mutex_actions == {}
+    assert all(layer is lazy_layer for layer, lazy_layer in zip(graph.layers(), lazy_layers))
+
+    eager_graph = build_graph()
+    for level in range(eager_graph.depth + 1):
+        assert loaded.layer(level) == eager_graph.layer(level)
+
+
+def test_write_snapshot_failure(tmp_path, monkeypatch):
+    def failing_dump(graph):
+        raise RuntimeError('dump failed')
+
+    monkeypatch.setattr(snapshot, 'dump_graph', failing_dump)
+
+    with pytest.raises(RuntimeError):
+        snapshot.write_snapshot(build_graph(), str(tmp_path / 'graph.gpg'))
+
+    assert list(tmp_path.iterdir()) == []